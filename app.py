@@ -1,191 +1,702 @@
+import time
+STARTUP_STARTED = time.perf_counter()
+
 import os
 import base64
-from flask import Flask, render_template, request, jsonify
-from werkzeug.utils import secure_filename
-from google.cloud import vision
-import google.generativeai as genai
+from flask import Flask, Request, Response, render_template, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 import io
+import sys
+import json
+import threading
+import urllib.request
+import atexit
+import asyncio
+import inspect
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from result_cache import ResultCache
+from jobs import JobStore, JobQueueFull
+from history import MealHistory
+from image_buffer import UploadedImage
+from preprocess import normalize_image
+from quota import ProviderScheduler, ProviderUnavailable
+from upload_guard import UploadRejected, GuardedStream, check_image
+from prescreen import measure_image, check_measurements
+from metrics import (registry, timed, REQUEST_SECONDS, REQUESTS, IN_FLIGHT, PROVIDER_RESULTS, FALLBACKS,
+                     CACHE_LOOKUPS, PROVIDER_REJECTIONS, UPLOAD_REJECTIONS, JOB_REJECTIONS, PRESCREEN_THRESHOLDS,
+                     PRESCREEN_MEASUREMENTS)
+
+class InMemoryRequest(Request):
+    """Keep multipart file parts in memory instead of spooling large ones to a temp file"""
+    
+    # Set to False before touching request.files to record rejected files instead of failing the request
+    abort_on_rejected_upload = True
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return upload_buffer(filename, abort=self.abort_on_rejected_upload)
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
+# Verbose per-request logging and the response 'debug' block; off in production
+app.config['VERBOSE_LOGGING'] = os.environ.get('SNAPTRACK_DEBUG', 'false').lower() == 'true'
+app.config['SPOOL_UPLOADS'] = os.environ.get('SNAPTRACK_SPOOL_UPLOADS', 'false').lower() == 'true'  # keep copies in UPLOAD_FOLDER for debugging
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-# Create uploads directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Upload screening: the extension, magic bytes and declared dimensions are checked while the body
+# streams in, so a bad upload is refused before the rest is read or any provider is called
+app.config['SCREEN_UPLOADS'] = os.environ.get('SNAPTRACK_SCREEN_UPLOADS', 'true').lower() == 'true'
+app.config['UPLOAD_MAX_PIXELS'] = int(os.environ.get('SNAPTRACK_UPLOAD_MAX_PIXELS', 40_000_000))  # decompression-bomb limit
+app.config['UPLOAD_MAX_DIMENSION'] = int(os.environ.get('SNAPTRACK_UPLOAD_MAX_DIMENSION', 12000))  # longest side, pixels
+app.config['UPLOAD_MIN_DIMENSION'] = int(os.environ.get('SNAPTRACK_UPLOAD_MIN_DIMENSION', 16))  # shortest side, pixels
+app.config['UPLOAD_PROBE_BYTES'] = int(os.environ.get('SNAPTRACK_UPLOAD_PROBE_BYTES', 256 * 1024))  # where to look for dimensions
+
+# Local pre-screen: brightness, contrast and sharpness are measured on a small grayscale copy, and
+# images no provider could use (black, washed out, blank, badly blurred) get a 422 without any provider call
+app.config['PRESCREEN_ENABLED'] = os.environ.get('SNAPTRACK_PRESCREEN', 'true').lower() == 'true'
+app.config['PRESCREEN_SIZE'] = int(os.environ.get('SNAPTRACK_PRESCREEN_SIZE', 256))  # longest side of the measured copy
+app.config['PRESCREEN_THRESHOLDS'] = {
+    'min_brightness': float(os.environ.get('SNAPTRACK_PRESCREEN_MIN_BRIGHTNESS', 15)),  # mean pixel value, 0-255
+    'max_brightness': float(os.environ.get('SNAPTRACK_PRESCREEN_MAX_BRIGHTNESS', 245)),
+    'min_contrast': float(os.environ.get('SNAPTRACK_PRESCREEN_MIN_CONTRAST', 3)),  # pixel standard deviation
+    'min_sharpness': float(os.environ.get('SNAPTRACK_PRESCREEN_MIN_SHARPNESS', 0.005)),  # Laplacian variance / pixel variance
+}
+
+# Result cache: identical or near-identical uploads reuse the stored analysis
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('SNAPTRACK_CACHE_SIZE', 256))  # in-memory LRU entries
+app.config['RESULT_CACHE_DIR'] = os.environ.get('SNAPTRACK_CACHE_DIR')  # on-disk tier, disabled if unset
+app.config['RESULT_CACHE_TTL'] = int(os.environ.get('SNAPTRACK_CACHE_TTL', 24 * 60 * 60))  # seconds
+app.config['RESULT_CACHE_MAX_DISK_ENTRIES'] = int(os.environ.get('SNAPTRACK_CACHE_MAX_DISK_ENTRIES', 5000))
+# Perceptual matching reuses another upload's analysis for a near-identical photo (same
+# hash within this many of 256 bits, same aspect ratio, same colours). Off unless set; ~20 is a sensible value.
+app.config['RESULT_CACHE_PHASH_DISTANCE'] = (int(os.environ['SNAPTRACK_CACHE_PHASH_DISTANCE'])
+                                             if os.environ.get('SNAPTRACK_CACHE_PHASH_DISTANCE') else None)
+app.config['RESULT_CACHE_COLOR_TOLERANCE'] = int(os.environ.get('SNAPTRACK_CACHE_COLOR_TOLERANCE', 24))  # max 4x4 thumbnail channel difference, 0-255
+
+# Vision API: request all features in one annotate call instead of three round trips
+app.config['VISION_SINGLE_REQUEST'] = os.environ.get('SNAPTRACK_VISION_SINGLE_REQUEST', 'true').lower() == 'true'
+app.config['VISION_BATCH_SIZE'] = 16  # images per batch_annotate_images call (API limit is 16)
+app.config['VISION_MAX_RESULTS'] = {
+    'web_detection': int(os.environ.get('SNAPTRACK_VISION_WEB_MAX_RESULTS', 10)),
+    'object_localization': int(os.environ.get('SNAPTRACK_VISION_OBJECT_MAX_RESULTS', 10)),
+    'label_detection': int(os.environ.get('SNAPTRACK_VISION_LABEL_MAX_RESULTS', 10)),
+}
+
+# Normalization: orient, downscale, strip metadata and re-encode before each provider sees the image
+app.config['NORMALIZE_IMAGES'] = os.environ.get('SNAPTRACK_NORMALIZE_IMAGES', 'true').lower() == 'true'
+app.config['NORMALIZE_PROFILES'] = {
+    'gemini': {
+        'max_dimension': int(os.environ.get('SNAPTRACK_GEMINI_MAX_DIMENSION', 1536)),
+        'format': os.environ.get('SNAPTRACK_GEMINI_FORMAT', 'JPEG'),
+        'quality': int(os.environ.get('SNAPTRACK_GEMINI_QUALITY', 85)),
+    },
+    'vision': {
+        'max_dimension': int(os.environ.get('SNAPTRACK_VISION_MAX_DIMENSION', 1024)),
+        'format': os.environ.get('SNAPTRACK_VISION_FORMAT', 'JPEG'),
+        'quality': int(os.environ.get('SNAPTRACK_VISION_QUALITY', 80)),
+    },
+}
+
+# Browser-side downscale before upload. The page re-encodes larger photos to this size so
+# mobile clients don't send pixels the server would discard; 0 sends the original file
+app.config['CLIENT_RESIZE'] = {
+    'max_dimension': int(os.environ.get('SNAPTRACK_CLIENT_MAX_DIMENSION',
+                                        max(profile['max_dimension'] for profile in app.config['NORMALIZE_PROFILES'].values()))),
+    'format': os.environ.get('SNAPTRACK_CLIENT_FORMAT', 'image/webp'),  # falls back to image/jpeg if the browser can't encode it
+    'quality': float(os.environ.get('SNAPTRACK_CLIENT_QUALITY', 0.9)),
+}
+
+# Gemini/Vision execution: 'serial' waits for Gemini to fail before calling Vision,
+# 'hedged' also starts Vision once Gemini has taken longer than the hedge delay,
+# 'parallel' starts both at once. Gemini is preferred if it answers before the deadline.
+app.config['ANALYSIS_MODE'] = os.environ.get('SNAPTRACK_ANALYSIS_MODE', 'serial')
+app.config['HEDGE_DELAY'] = float(os.environ.get('SNAPTRACK_HEDGE_DELAY', 4.0))  # seconds
+app.config['REQUEST_DEADLINE'] = float(os.environ.get('SNAPTRACK_REQUEST_DEADLINE', 30.0))  # seconds
+app.config['PROVIDER_WORKERS'] = int(os.environ.get('SNAPTRACK_PROVIDER_WORKERS', 16))
+
+# Provider quotas: a token bucket per provider (0 requests/minute means unlimited), a short
+# wait queue for the next token, and a circuit breaker that stops calling a provider after
+# repeated errors (threshold 0 disables it). Refused Gemini calls go straight to Vision.
+# The Gemini free tier allows about 2 requests/minute.
+app.config['PROVIDER_QUOTAS'] = {
+    'gemini': {
+        'rate_per_minute': float(os.environ.get('SNAPTRACK_GEMINI_RPM', 0)),
+        'burst': int(os.environ.get('SNAPTRACK_GEMINI_BURST', 2)),
+        'max_wait': float(os.environ.get('SNAPTRACK_GEMINI_MAX_WAIT', 1.0)),  # seconds
+        'max_queue': int(os.environ.get('SNAPTRACK_GEMINI_MAX_QUEUE', 8)),
+        'failure_threshold': int(os.environ.get('SNAPTRACK_GEMINI_BREAKER_THRESHOLD', 5)),
+        'reset_timeout': float(os.environ.get('SNAPTRACK_GEMINI_BREAKER_RESET', 30.0)),  # seconds
+        'probe_timeout': float(os.environ.get('SNAPTRACK_GEMINI_BREAKER_PROBE_TIMEOUT', 60.0)),  # seconds
+    },
+    'vision': {
+        'rate_per_minute': float(os.environ.get('SNAPTRACK_VISION_RPM', 0)),
+        'burst': int(os.environ.get('SNAPTRACK_VISION_BURST', 10)),
+        'max_wait': float(os.environ.get('SNAPTRACK_VISION_MAX_WAIT', 2.0)),
+        'max_queue': int(os.environ.get('SNAPTRACK_VISION_MAX_QUEUE', 32)),
+        'failure_threshold': int(os.environ.get('SNAPTRACK_VISION_BREAKER_THRESHOLD', 0)),
+        'reset_timeout': float(os.environ.get('SNAPTRACK_VISION_BREAKER_RESET', 30.0)),
+        'probe_timeout': float(os.environ.get('SNAPTRACK_VISION_BREAKER_PROBE_TIMEOUT', 60.0)),
+    },
+}
+
+# Gemini output: 'detailed' asks for free-form sections, 'compact' for a small JSON object
+# with a capped output token budget (fewer output tokens means lower latency and cost)
+app.config['GEMINI_OUTPUT_MODE'] = os.environ.get('SNAPTRACK_GEMINI_OUTPUT_MODE', 'detailed')
+app.config['GEMINI_MAX_OUTPUT_TOKENS'] = int(os.environ.get('SNAPTRACK_GEMINI_MAX_OUTPUT_TOKENS', 256))
+app.config['GEMINI_COMPACT_DESCRIPTION'] = os.environ.get('SNAPTRACK_GEMINI_COMPACT_DESCRIPTION', 'false').lower() == 'true'
+
+# Batch uploads: number of Gemini analyses run at the same time, and files accepted per request
+app.config['BATCH_CONCURRENCY'] = int(os.environ.get('SNAPTRACK_BATCH_CONCURRENCY', 4))
+app.config['BATCH_MAX_FILES'] = int(os.environ.get('SNAPTRACK_BATCH_MAX_FILES', 50))
+
+# Background jobs: /jobs returns an id at once, analysis runs on a worker pool
+app.config['JOB_WORKERS'] = int(os.environ.get('SNAPTRACK_JOB_WORKERS', 4))
+# Process workers each get their own copy of the provider quota schedulers, which would multiply
+# the request budget by JOB_WORKERS, so they are only used when no provider rate limit is set.
+# Even then a worker's circuit breakers are its own: trips there don't reach the web process.
+app.config['JOB_WORKER_TYPE'] = os.environ.get('SNAPTRACK_JOB_WORKER_TYPE', 'thread')  # 'thread' or 'process'
+app.config['JOB_TTL'] = int(os.environ.get('SNAPTRACK_JOB_TTL', 15 * 60))  # seconds a finished job is kept
+app.config['JOB_MAX_QUEUED'] = int(os.environ.get('SNAPTRACK_JOB_MAX_QUEUED', 64))  # jobs waiting for a worker; more get 503
+app.config['JOB_CALLBACKS_ENABLED'] = os.environ.get('SNAPTRACK_JOB_CALLBACKS', 'false').lower() == 'true'
+
+# Meal history: every successful analysis is logged per user in SQLite at this path; off unless a path is set
+app.config['HISTORY_DB'] = os.environ.get('SNAPTRACK_HISTORY_DB', '')
+app.config['HISTORY_BATCH_SIZE'] = int(os.environ.get('SNAPTRACK_HISTORY_BATCH_SIZE', 100))  # meals per write transaction
+app.config['HISTORY_FLUSH_INTERVAL'] = float(os.environ.get('SNAPTRACK_HISTORY_FLUSH_INTERVAL', 1.0))  # max seconds a meal waits to be written
+app.config['HISTORY_MAX_QUEUE'] = int(os.environ.get('SNAPTRACK_HISTORY_MAX_QUEUE', 10000))  # meals beyond this are dropped
+# Meals are filed under the user named in this request header, which must be set by an
+# authenticating proxy in front of the app. Without it nothing is logged and reads are refused.
+app.config['HISTORY_USER_HEADER'] = os.environ.get('SNAPTRACK_HISTORY_USER_HEADER', '')  # e.g. X-Forwarded-User
+app.config['HISTORY_PAGE_SIZE'] = 20
+app.config['HISTORY_MAX_PAGE_SIZE'] = 100
+
+# ASGI serving (asgi.py): /upload runs on the event loop with the async provider clients;
+# the other routes run on this many threads
+app.config['ASGI_WSGI_WORKERS'] = int(os.environ.get('SNAPTRACK_ASGI_WSGI_WORKERS', 16))
+
+# Provider SDKs are imported and their clients created on first use. Warm-up does that in a
+# background thread at startup instead, and opens the gRPC channels before the first request.
+app.config['WARM_UP'] = os.environ.get('SNAPTRACK_WARM_UP', 'false').lower() == 'true'
+app.config['WARM_UP_TIMEOUT'] = float(os.environ.get('SNAPTRACK_WARM_UP_TIMEOUT', 10.0))  # seconds per channel
+
+# Fake providers (see fakes.py) for load tests and offline runs: no credentials or network needed.
+# Latency specs are 'fixed:MS', 'uniform:MIN,MAX' or 'lognormal:MEDIAN,SIGMA'
+app.config['FAKE_PROVIDERS'] = os.environ.get('SNAPTRACK_FAKE_PROVIDERS', 'false').lower() == 'true'
+app.config['FAKE_VISION_LATENCY'] = os.environ.get('SNAPTRACK_FAKE_VISION_LATENCY', 'lognormal:700,0.35')
+app.config['FAKE_VISION_ERROR_RATE'] = float(os.environ.get('SNAPTRACK_FAKE_VISION_ERROR_RATE', 0.0))
+app.config['FAKE_GEMINI_LATENCY'] = os.environ.get('SNAPTRACK_FAKE_GEMINI_LATENCY', 'lognormal:2500,0.4')
+app.config['FAKE_GEMINI_ERROR_RATE'] = float(os.environ.get('SNAPTRACK_FAKE_GEMINI_ERROR_RATE', 0.0))
+app.config['FAKE_GEMINI_RESPONSES'] = os.environ.get('SNAPTRACK_FAKE_GEMINI_RESPONSES')  # recorded responses JSON, optional
+
+# Uploads are processed in memory; the folder is only needed for the debug spool
+if app.config['SPOOL_UPLOADS']:
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+# Startup and warm-up step durations in ms, printed once and reported by /api/status
+startup_timings = {'imports': round((time.perf_counter() - STARTUP_STARTED) * 1000, 1)}
+
+@contextmanager
+def startup_step(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = round((time.perf_counter() - started) * 1000, 1)
 
 # Configure Gemini API
-# Get API key from environment variable or use default
+# Get API key from environment variable or use default; the SDK itself is configured on first use
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 print(f"[STARTUP] Checking for GEMINI_API_KEY...")
 print(f"[STARTUP] Environment variable present: {bool(os.environ.get('GEMINI_API_KEY'))}")
 if GEMINI_API_KEY:
     print(f"[STARTUP] GEMINI_API_KEY found: {GEMINI_API_KEY[:20]}...")
-    try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        print(f"[INFO] Gemini API configured successfully with key: {GEMINI_API_KEY[:20]}...")
-    except Exception as e:
-        print(f"[WARNING] Failed to configure Gemini API: {e}")
-        GEMINI_API_KEY = None
 else:
     print(f"[INFO] GEMINI_API_KEY not set - will use Vision API only")
 
+if app.config['FAKE_PROVIDERS']:
+    from fakes import FakeImageAnnotatorClient, FakeGenerativeModel
+    FakeImageAnnotatorClient.configure(latency=app.config['FAKE_VISION_LATENCY'],
+                                       error_rate=app.config['FAKE_VISION_ERROR_RATE'])
+    FakeGenerativeModel.configure(latency=app.config['FAKE_GEMINI_LATENCY'],
+                                  error_rate=app.config['FAKE_GEMINI_ERROR_RATE'],
+                                  responses=app.config['FAKE_GEMINI_RESPONSES'])
+    GEMINI_API_KEY = GEMINI_API_KEY or 'fake-provider-key'
+    print(f"[STARTUP] Using fake providers (Vision {app.config['FAKE_VISION_LATENCY']}, "
+          f"Gemini {app.config['FAKE_GEMINI_LATENCY']})")
+
+result_cache = ResultCache(
+    max_entries=app.config['RESULT_CACHE_SIZE'],
+    disk_dir=app.config['RESULT_CACHE_DIR'],
+    ttl=app.config['RESULT_CACHE_TTL'],
+    max_disk_entries=app.config['RESULT_CACHE_MAX_DISK_ENTRIES'],
+    phash_distance=app.config['RESULT_CACHE_PHASH_DISTANCE'],
+    color_tolerance=app.config['RESULT_CACHE_COLOR_TOLERANCE'],
+)
+
+def push_job_result(job):
+    """POST a finished job to its callback_url, if one was given"""
+    callback_url = job.get('callback_url')
+    if not callback_url:
+        return
+    
+    def send():
+        payload = json.dumps({key: job[key] for key in ('id', 'status', 'result', 'error')}).encode('utf-8')
+        callback = urllib.request.Request(callback_url, data=payload, headers={'Content-Type': 'application/json'})
+        try:
+            urllib.request.urlopen(callback, timeout=10).close()
+        except Exception as e:
+            print(f"[JOBS] Callback to {callback_url} failed for job {job['id']}: {e}")
+    
+    threading.Thread(target=send, daemon=True).start()
+
+if app.config['PRESCREEN_ENABLED']:
+    for threshold, value in app.config['PRESCREEN_THRESHOLDS'].items():
+        PRESCREEN_THRESHOLDS.set(value, threshold=threshold)
+
+provider_schedulers = {kind: ProviderScheduler(kind, **quota) for kind, quota in app.config['PROVIDER_QUOTAS'].items()}
+
+if app.config['JOB_WORKER_TYPE'] == 'process' and any(quota['rate_per_minute'] for quota in app.config['PROVIDER_QUOTAS'].values()):
+    print("[STARTUP] Provider rate limits are set; using thread job workers so every job shares one quota")
+    app.config['JOB_WORKER_TYPE'] = 'thread'
+
+# Pools for hedged/parallel provider calls, one per provider so a Vision hedge never queues
+# behind Gemini calls that lost the race and are still running; losing calls finish here
+gemini_executor = ThreadPoolExecutor(max_workers=app.config['PROVIDER_WORKERS'], thread_name_prefix='snaptrack-gemini')
+vision_executor = ThreadPoolExecutor(max_workers=app.config['PROVIDER_WORKERS'], thread_name_prefix='snaptrack-vision')
+gemini_calls_pending = 0  # submitted to gemini_executor and not finished yet
+_gemini_pending_lock = threading.Lock()
+
+job_store = JobStore(
+    workers=app.config['JOB_WORKERS'],
+    worker_type=app.config['JOB_WORKER_TYPE'],
+    ttl=app.config['JOB_TTL'],
+    max_queued=app.config['JOB_MAX_QUEUED'],
+    on_complete=lambda job: (record_job_meal(job), push_job_result(job)),
+)
+
+meal_history = None
+if app.config['HISTORY_DB']:
+    with startup_step('history'):
+        meal_history = MealHistory(
+            app.config['HISTORY_DB'],
+            batch_size=app.config['HISTORY_BATCH_SIZE'],
+            flush_interval=app.config['HISTORY_FLUSH_INTERVAL'],
+            max_queue=app.config['HISTORY_MAX_QUEUE'],
+        )
+    # Write out whatever is still queued on a clean shutdown
+    atexit.register(meal_history.flush)
+
+def debug_log(message):
+    """Print a per-request diagnostic line, only when verbose logging is on"""
+    if app.config['VERBOSE_LOGGING']:
+        print(message, file=sys.stderr, flush=True)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-def detect_food_items(image_path):
-    """Use Google Vision API to detect food items in the image"""
+def upload_file_error(files):
+    """Validation error for the request's 'file' part, or None if it can be analyzed"""
+    if 'file' not in files:
+        return 'No file provided'
+    if files['file'].filename == '':
+        return 'No file selected'
+    if not allowed_file(files['file'].filename):
+        return 'Invalid file type. Please upload an image (PNG, JPG, JPEG, GIF, WEBP)'
+    return None
+
+def upload_limits():
+    return {
+        'allowed_extensions': app.config['ALLOWED_EXTENSIONS'],
+        'max_pixels': app.config['UPLOAD_MAX_PIXELS'],
+        'max_dimension': app.config['UPLOAD_MAX_DIMENSION'],
+        'min_dimension': app.config['UPLOAD_MIN_DIMENSION'],
+        'probe_bytes': app.config['UPLOAD_PROBE_BYTES'],
+    }
+
+def upload_buffer(filename, abort=True):
+    """Buffer for an incoming multipart file part, screening it as it arrives when enabled"""
+    if not app.config['SCREEN_UPLOADS']:
+        return io.BytesIO()
+    return GuardedStream(filename, upload_limits(), abort=abort)
+
+def rejection_payload(rejection):
+    """Count an UploadRejected and return its JSON error body"""
+    UPLOAD_REJECTIONS.inc(reason=rejection.reason)
+    debug_log(f"[UPLOAD] Rejected ({rejection.reason}): {rejection}")
+    payload = {'error': str(rejection), 'reason': rejection.reason}
+    if rejection.details:
+        payload.update(rejection.details)
+    return payload
+
+def prescreen(upload):
+    """Measure the decoded upload and raise UploadRejected if it fails a pre-screen threshold"""
     try:
-        # Try to get credentials from environment variable, or use default path
-        credentials_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-        
-        # Default path (can be customized)
-        default_path = r"C:\Users\kyle\Downloads\snaptrack-482706-0d453712c512.json"
-        
-        # If not set, try default path
-        if not credentials_path:
-            if os.path.exists(default_path):
-                os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = default_path
-                credentials_path = default_path
-            else:
-                raise Exception(
-                    'Google Cloud credentials not found. Please set the GOOGLE_APPLICATION_CREDENTIALS '
-                    'environment variable to the path of your service account JSON key file. '
-                    'See README.md for setup instructions.'
-                )
-        elif not os.path.exists(credentials_path):
-            raise Exception(
-                f'Credentials file not found at: {credentials_path}. '
-                'Please check the path and try again.'
-            )
-        
-        # Initialize the Vision API client
-        client = vision.ImageAnnotatorClient()
-        
-        # Read the image file
-        with io.open(image_path, 'rb') as image_file:
-            content = image_file.read()
-        
-        image = vision.Image(content=content)
-        
-        # Perform multiple detection types for comprehensive results
-        detected_items = []
-        seen_descriptions = set()
-        
-        # 1. Web Detection - Provides more descriptive labels based on web context
-        # This often gives more detailed descriptions like "hamburger with lettuce and tomato"
-        web_response = client.web_detection(image=image)
-        web_detection = web_response.web_detection
-        
-        # Best guess labels from web detection (often more descriptive)
-        if web_detection.best_guess_labels:
-            for label in web_detection.best_guess_labels:
-                desc = label.label.lower()
-                if desc not in seen_descriptions:
-                    detected_items.append({
-                        'description': label.label,
-                        'confidence': 95.0,  # Best guess labels don't have scores, but are high confidence
-                        'type': 'web_best_guess'
-                    })
-                    seen_descriptions.add(desc)
-        
-        # Web entities (descriptive entities found on the web)
-        if web_detection.web_entities:
-            for entity in web_detection.web_entities:
-                if entity.score > 0.5 and entity.description:
-                    desc = entity.description.lower()
-                    # Filter out very generic terms
-                    if desc not in seen_descriptions and len(desc) > 2:
-                        # Ensure confidence is between 0-100%
-                        confidence = min(100.0, round(entity.score * 100, 2))
-                        detected_items.append({
-                            'description': entity.description,
-                            'confidence': confidence,
-                            'type': 'web_entity'
-                        })
-                        seen_descriptions.add(desc)
-        
-        # 2. Object Localization - Detects specific objects in the image
-        objects_response = client.object_localization(image=image)
-        objects = objects_response.localized_object_annotations
-        
-        for obj in objects:
-            if obj.score > 0.5:
-                desc = obj.name.lower()
-                if desc not in seen_descriptions:
-                    # Ensure confidence is between 0-100%
-                    confidence = min(100.0, round(obj.score * 100, 2))
-                    detected_items.append({
-                        'description': obj.name,
-                        'confidence': confidence,
-                        'type': 'object'
-                    })
-                    seen_descriptions.add(desc)
-        
-        # 3. Label Detection - General labels (fallback)
-        label_response = client.label_detection(image=image)
-        labels = label_response.label_annotations
-        
-        for label in labels:
-            if label.score > 0.5:
-                desc = label.description.lower()
-                # Skip very generic terms if we already have specific ones
-                generic_terms = {'food', 'dish', 'cuisine', 'meal', 'ingredient'}
-                if desc not in seen_descriptions and desc not in generic_terms:
+        image = upload.decoded()
+    except Exception:
+        raise UploadRejected('corrupt', 'The image file is corrupt')
+    with timed('prescreen'):
+        measurements = measure_image(image, app.config['PRESCREEN_SIZE'])
+    for name, value in measurements.items():
+        PRESCREEN_MEASUREMENTS.observe(value, measurement=name)
+    check_measurements(measurements, app.config['PRESCREEN_THRESHOLDS'])
+
+def read_upload(file):
+    """Read a request file part into an UploadedImage, spooling a copy if debugging is on.
+    Raises UploadRejected if the image fails screening."""
+    rejection = getattr(file.stream, 'rejection', None)
+    if rejection is not None:
+        raise rejection
+    draft_dimension = None
+    if app.config['NORMALIZE_IMAGES']:
+        draft_dimension = max(profile['max_dimension'] for profile in app.config['NORMALIZE_PROFILES'].values())
+    with timed('read'):
+        upload = UploadedImage(file.read(), file.filename, draft_dimension=draft_dimension)
+    if app.config['SCREEN_UPLOADS']:
+        with timed('screen'):
+            check_image(upload.data, upload_limits())
+    if app.config['PRESCREEN_ENABLED']:
+        prescreen(upload)
+    if app.config['SPOOL_UPLOADS']:
+        debug_log(f"[UPLOAD] Spooled copy to: {upload.spool(app.config['UPLOAD_FOLDER'])}")
+    return upload
+
+def provider_image(upload, provider):
+    """The copy of upload to send to provider ('gemini' or 'vision'), normalized with its profile"""
+    if not app.config['NORMALIZE_IMAGES']:
+        return upload
+    if provider not in upload.variants:
+        with timed(f'normalize_{provider}'):
+            normalized, stats = normalize_image(upload, **app.config['NORMALIZE_PROFILES'][provider])
+        upload.variants[provider] = normalized
+        upload.variant_stats[provider] = stats
+        debug_log(f"[NORMALIZE] {provider}: {stats['original_bytes']} -> {stats['bytes']} bytes in {stats['ms']}ms")
+    return upload.variants[provider]
+
+def cache_kind(kind):
+    """Result cache namespace for a provider; Gemini results differ by output mode"""
+    if kind == 'gemini':
+        return f"gemini-{app.config['GEMINI_OUTPUT_MODE']}"
+    return kind
+
+def cache_lookup(kind, upload, cache_info):
+    """result_cache.get for an upload, recording the hit type in cache_info and metrics"""
+    result, hit_type, keys = result_cache.get(cache_kind(kind), upload.data, upload.decoded)
+    cache_info[kind] = hit_type or 'miss'
+    CACHE_LOOKUPS.inc(provider=kind, result=hit_type or 'miss')
+    return result, hit_type, keys
+
+def admit(kind):
+    """Wait for kind's quota scheduler to allow a call; raises ProviderUnavailable if it won't"""
+    try:
+        provider_schedulers[kind].acquire()
+    except ProviderUnavailable as e:
+        PROVIDER_REJECTIONS.inc(provider=kind, reason=e.reason)
+        debug_log(f"[QUOTA] {kind} call refused: {e}")
+        raise
+
+async def admit_async(kind):
+    try:
+        await provider_schedulers[kind].acquire_async()
+    except ProviderUnavailable as e:
+        PROVIDER_REJECTIONS.inc(provider=kind, reason=e.reason)
+        debug_log(f"[QUOTA] {kind} call refused: {e}")
+        raise
+
+def record_outcome(kind, success):
+    """Count a finished provider call and feed it to the provider's circuit breaker"""
+    PROVIDER_RESULTS.inc(provider=kind, outcome='success' if success else 'error')
+    provider_schedulers[kind].record(success)
+
+def record_cancelled(kind):
+    """Count a provider call abandoned before it finished (deadline, lost race or client
+    disconnect) so a cancelled half-open probe doesn't hold the breaker's probe slot"""
+    PROVIDER_RESULTS.inc(provider=kind, outcome='cancelled')
+    provider_schedulers[kind].abandon()
+
+def fallback_reason(gemini_error):
+    """FALLBACKS reason for a Gemini failure: gemini_quota, gemini_circuit_open or gemini_error"""
+    if isinstance(gemini_error, ProviderUnavailable):
+        return f'gemini_{gemini_error.reason}'
+    return 'gemini_error'
+
+def cached_call(kind, upload, compute, cache_info):
+    """Return compute() through the result cache, recording the hit type in cache_info.
+    Cache misses go through the provider's quota scheduler."""
+    result, hit_type, keys = cache_lookup(kind, upload, cache_info)
+    if hit_type:
+        return result
+    admit(kind)
+    try:
+        result = compute()
+    except Exception:
+        record_outcome(kind, False)
+        raise
+    except BaseException:
+        record_cancelled(kind)
+        raise
+    record_outcome(kind, True)
+    result_cache.put(cache_kind(kind), keys, result)
+    return result
+
+def vision_features():
+    """Feature list for a combined Vision annotate request, honoring per-feature max_results"""
+    max_results = app.config['VISION_MAX_RESULTS']
+    # Feature types by enum name, so building a request doesn't need the Vision SDK imported
+    return [
+        {'type_': 'WEB_DETECTION', 'max_results': max_results['web_detection']},
+        {'type_': 'OBJECT_LOCALIZATION', 'max_results': max_results['object_localization']},
+        {'type_': 'LABEL_DETECTION', 'max_results': max_results['label_detection']},
+    ]
+
+def merge_vision_annotations(web_detection, objects, labels):
+    """Merge web, object and label annotations into one deduplicated, sorted item list"""
+    # Perform multiple detection types for comprehensive results
+    detected_items = []
+    seen_descriptions = set()
+    
+    # 1. Web Detection - Provides more descriptive labels based on web context
+    # This often gives more detailed descriptions like "hamburger with lettuce and tomato"
+    # Best guess labels from web detection (often more descriptive)
+    if web_detection.best_guess_labels:
+        for label in web_detection.best_guess_labels:
+            desc = label.label.lower()
+            if desc not in seen_descriptions:
+                detected_items.append({
+                    'description': label.label,
+                    'confidence': 95.0,  # Best guess labels don't have scores, but are high confidence
+                    'type': 'web_best_guess'
+                })
+                seen_descriptions.add(desc)
+    
+    # Web entities (descriptive entities found on the web)
+    if web_detection.web_entities:
+        for entity in web_detection.web_entities:
+            if entity.score > 0.5 and entity.description:
+                desc = entity.description.lower()
+                # Filter out very generic terms
+                if desc not in seen_descriptions and len(desc) > 2:
                     # Ensure confidence is between 0-100%
-                    confidence = min(100.0, round(label.score * 100, 2))
+                    confidence = min(100.0, round(entity.score * 100, 2))
                     detected_items.append({
-                        'description': label.description,
+                        'description': entity.description,
                         'confidence': confidence,
-                        'type': 'label'
+                        'type': 'web_entity'
                     })
                     seen_descriptions.add(desc)
+    
+    # 2. Object Localization - Detects specific objects in the image
+    for obj in objects:
+        if obj.score > 0.5:
+            desc = obj.name.lower()
+            if desc not in seen_descriptions:
+                # Ensure confidence is between 0-100%
+                confidence = min(100.0, round(obj.score * 100, 2))
+                detected_items.append({
+                    'description': obj.name,
+                    'confidence': confidence,
+                    'type': 'object'
+                })
+                seen_descriptions.add(desc)
+    
+    # 3. Label Detection - General labels (fallback)
+    for label in labels:
+        if label.score > 0.5:
+            desc = label.description.lower()
+            # Skip very generic terms if we already have specific ones
+            generic_terms = {'food', 'dish', 'cuisine', 'meal', 'ingredient'}
+            if desc not in seen_descriptions and desc not in generic_terms:
+                # Ensure confidence is between 0-100%
+                confidence = min(100.0, round(label.score * 100, 2))
+                detected_items.append({
+                    'description': label.description,
+                    'confidence': confidence,
+                    'type': 'label'
+                })
+                seen_descriptions.add(desc)
+    
+    # Sort by confidence (highest first)
+    detected_items.sort(key=lambda x: x['confidence'], reverse=True)
+    
+    return detected_items
+
+def ensure_vision_credentials():
+    """Resolve GOOGLE_APPLICATION_CREDENTIALS, falling back to the default key path"""
+    if app.config['FAKE_PROVIDERS']:
+        return
+    
+    # Try to get credentials from environment variable, or use default path
+    credentials_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+    
+    # Default path (can be customized)
+    default_path = r"C:\Users\kyle\Downloads\snaptrack-482706-0d453712c512.json"
+    
+    # If not set, try default path
+    if not credentials_path:
+        if os.path.exists(default_path):
+            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = default_path
+            credentials_path = default_path
+        else:
+            raise Exception(
+                'Google Cloud credentials not found. Please set the GOOGLE_APPLICATION_CREDENTIALS '
+                'environment variable to the path of your service account JSON key file. '
+                'See README.md for setup instructions.'
+            )
+    elif not os.path.exists(credentials_path):
+        raise Exception(
+            f'Credentials file not found at: {credentials_path}. '
+            'Please check the path and try again.'
+        )
+
+# Process-wide provider clients. Each is created once, under a lock so concurrent first
+# requests don't build several, and then shared: the clients are thread-safe and reuse
+# their gRPC channel across calls.
+_provider_lock = threading.Lock()
+_vision_client = None
+_vision_async_client = None
+_gemini_model = None
+
+def get_vision_client():
+    """The shared Vision client, created (and credentials checked) on first use"""
+    global _vision_client
+    if _vision_client is None:
+        with _provider_lock:
+            if _vision_client is None:
+                ensure_vision_credentials()
+                if app.config['FAKE_PROVIDERS']:
+                    _vision_client = FakeImageAnnotatorClient()
+                else:
+                    from google.cloud import vision
+                    _vision_client = vision.ImageAnnotatorClient()
+    return _vision_client
+
+def detect_food_items(upload):
+    """Use Google Vision API to detect food items in the image"""
+    try:
+        # Shared Vision API client
+        client = get_vision_client()
         
-        # Check for errors
-        if label_response.error.message:
-            raise Exception(f'Google Vision API error: {label_response.error.message}')
+        image = {'content': upload.data}
         
-        # Sort by confidence (highest first)
-        detected_items.sort(key=lambda x: x['confidence'], reverse=True)
+        if app.config['VISION_SINGLE_REQUEST']:
+            # One annotate call carrying all three features - the image is sent once
+            with timed('vision_annotate'):
+                response = client.annotate_image({
+                    'image': image,
+                    'features': vision_features(),
+                })
+            if response.error.message:
+                raise Exception(f'Google Vision API error: {response.error.message}')
+            detected_items = merge_vision_annotations(
+                response.web_detection,
+                response.localized_object_annotations,
+                response.label_annotations
+            )
+        else:
+            # Legacy mode: one round trip per feature
+            with timed('vision_web_detection'):
+                web_response = client.web_detection(image=image)
+            with timed('vision_object_localization'):
+                objects_response = client.object_localization(image=image)
+            with timed('vision_label_detection'):
+                label_response = client.label_detection(image=image)
+            
+            # Check for errors
+            if label_response.error.message:
+                raise Exception(f'Google Vision API error: {label_response.error.message}')
+            
+            detected_items = merge_vision_annotations(
+                web_response.web_detection,
+                objects_response.localized_object_annotations,
+                label_response.label_annotations
+            )
         
         return detected_items
     
     except Exception as e:
         raise Exception(f'Error detecting food items: {str(e)}')
 
-def analyze_food_with_gemini(image_path):
-    """Use Google Gemini API to get detailed food descriptions"""
+def detect_food_items_batch(uploads):
+    """Run Vision on many images with batch_annotate_images.
+
+    Returns one entry per input, in input order: either the item list or the
+    Exception raised for that image.
+    """
     try:
-        # Check if Gemini API key is configured
-        if not GEMINI_API_KEY:
-            raise Exception(
-                'Gemini API key not found. Please set the GEMINI_API_KEY environment variable. '
-                'Get your API key from https://ai.google.dev/'
-            )
-        
-        # Read the image file
-        with io.open(image_path, 'rb') as image_file:
-            image_data = image_file.read()
-        
-        # Initialize Gemini model - use available model names
-        # Available models: gemini-2.5-flash, gemini-2.5-pro, gemini-pro-latest
-        # Use gemini-2.5-flash (fast and available)
+        client = get_vision_client()
+    except Exception as e:
+        error = Exception(f'Error detecting food items: {str(e)}')
+        return [error for _ in uploads]
+    
+    results = []
+    chunk_size = app.config['VISION_BATCH_SIZE']
+    for start in range(0, len(uploads), chunk_size):
+        chunk = uploads[start:start + chunk_size]
+        requests_ = [
+            {'image': {'content': upload.data}, 'features': vision_features()}
+            for upload in chunk
+        ]
         try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
+            with timed('vision_batch_annotate'):
+                batch_response = client.batch_annotate_images(requests=requests_)
         except Exception as e:
-            # Fallback to gemini-pro-latest if flash doesn't work
-            app.logger.warning(f"gemini-2.5-flash failed: {e}, trying gemini-pro-latest")
-            try:
-                model = genai.GenerativeModel('gemini-pro-latest')
-            except Exception as e2:
-                # Last resort - try gemini-2.5-pro
-                app.logger.warning(f"gemini-pro-latest failed: {e2}, trying gemini-2.5-pro")
-                model = genai.GenerativeModel('gemini-2.5-pro')
+            error = Exception(f'Error detecting food items: {str(e)}')
+            results.extend(error for _ in chunk)
+            continue
         
-        # Create a detailed prompt for food analysis
-        prompt = """You are a food identification expert. Analyze this food image CAREFULLY and accurately.
+        # Responses come back in the same order as the requests
+        for response in batch_response.responses:
+            if response.error.message:
+                results.append(Exception(f'Error detecting food items: Google Vision API error: {response.error.message}'))
+            else:
+                results.append(merge_vision_annotations(
+                    response.web_detection,
+                    response.localized_object_annotations,
+                    response.label_annotations
+                ))
+    return results
+
+def get_vision_async_client():
+    """The shared Vision async client, created on first use inside the serving event loop"""
+    global _vision_async_client
+    if _vision_async_client is None:
+        ensure_vision_credentials()
+        if app.config['FAKE_PROVIDERS']:
+            from fakes import FakeImageAnnotatorAsyncClient
+            _vision_async_client = FakeImageAnnotatorAsyncClient()
+        else:
+            from google.cloud import vision
+            _vision_async_client = vision.ImageAnnotatorAsyncClient()
+    return _vision_async_client
+
+async def detect_food_items_async(upload):
+    """Async variant of detect_food_items: waits on Vision without holding a thread"""
+    try:
+        client = get_vision_async_client()
+        
+        # The async client has no annotate_image helper; a one-image batch is the same single call
+        with timed('vision_annotate'):
+            batch_response = await client.batch_annotate_images(requests=[{
+                'image': {'content': upload.data},
+                'features': vision_features(),
+            }])
+        response = batch_response.responses[0]
+        if response.error.message:
+            raise Exception(f'Google Vision API error: {response.error.message}')
+        return merge_vision_annotations(
+            response.web_detection,
+            response.localized_object_annotations,
+            response.label_annotations
+        )
+    
+    except Exception as e:
+        raise Exception(f'Error detecting food items: {str(e)}')
+
+# Prompt sent with every image to Gemini
+GEMINI_PROMPT = """You are a food identification expert. Analyze this food image CAREFULLY and accurately.
 
 CRITICAL RULES:
 1. ONLY describe what you can ACTUALLY SEE in the image. Do NOT guess or assume items that aren't visible.
@@ -204,123 +715,724 @@ Example: "French fries" or "None"
 DETAILED DESCRIPTION: [2-3 sentences describing everything visible in detail]
 
 Be accurate and specific. Only mention items you can actually see in the image."""
+
+def gemini_compact_prompt(include_description):
+    """Prompt for compact mode: a fixed JSON schema with no examples to echo back"""
+    description_field = ', "description": "<one sentence>"' if include_description else ''
+    return (
+        'Identify the food visible in this image. Only list items you can actually see, '
+        'with specific visible ingredients. Reply with JSON only, no markdown, in this schema: '
+        '{"items": [{"name": "<specific item with visible ingredients>", "confidence": <0-1>}]'
+        + description_field + '}. The first item is the main dish.'
+    )
+
+def parse_gemini_compact(text):
+    """Single-pass parse of a compact-mode response.
+    
+    Returns (items, description). Raises ValueError if the text isn't the
+    expected JSON, so callers can fall back to parse_gemini_response.
+    """
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        raise ValueError('No JSON object in Gemini response')
+    data = json.loads(text[start:end + 1])
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        raise ValueError('Gemini response JSON has no items list')
+    
+    detected_items = []
+    for index, entry in enumerate(data['items']):
+        if not isinstance(entry, dict) or not str(entry.get('name', '')).strip():
+            continue
+        default_confidence = 95.0 if index == 0 else 90.0
+        try:
+            confidence = float(entry.get('confidence', default_confidence / 100))
+        except (TypeError, ValueError):
+            confidence = default_confidence / 100
+        # Ensure confidence is between 0-100%
+        confidence = min(100.0, max(0.0, round(confidence * 100 if confidence <= 1 else confidence, 2)))
+        detected_items.append({
+            'description': str(entry['name']).strip(),
+            'confidence': confidence,
+            'type': 'gemini_main' if index == 0 else 'gemini_additional'
+        })
+    if not detected_items:
+        raise ValueError('Gemini response JSON has no usable items')
+    
+    description = data.get('description')
+    return detected_items, description if isinstance(description, str) else ''
+
+def get_gemini_model():
+    """The shared Gemini model, created on first use by trying each known model name in turn"""
+    global _gemini_model
+    if _gemini_model is not None:
+        return _gemini_model
+    with _provider_lock:
+        if _gemini_model is not None:
+            return _gemini_model
+        if app.config['FAKE_PROVIDERS']:
+            model_class = FakeGenerativeModel
+        else:
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            model_class = genai.GenerativeModel
         
-        # Prepare the image
+        # Initialize Gemini model - use available model names
+        # Available models: gemini-2.5-flash, gemini-2.5-pro, gemini-pro-latest
+        # Use gemini-2.5-flash (fast and available)
+        try:
+            model = model_class('gemini-2.5-flash')
+        except Exception as e:
+            # Fallback to gemini-pro-latest if flash doesn't work
+            app.logger.warning(f"gemini-2.5-flash failed: {e}, trying gemini-pro-latest")
+            try:
+                model = model_class('gemini-pro-latest')
+            except Exception as e2:
+                # Last resort - try gemini-2.5-pro
+                app.logger.warning(f"gemini-pro-latest failed: {e2}, trying gemini-2.5-pro")
+                model = model_class('gemini-2.5-pro')
+        _gemini_model = model
+    return _gemini_model
+
+def open_channel(client, timeout):
+    """Connect a gRPC client's channel now rather than on its first call"""
+    channel = getattr(getattr(client, 'transport', None), 'grpc_channel', None)
+    if channel is not None:
+        import grpc
+        try:
+            grpc.channel_ready_future(channel).result(timeout=timeout)
+        except grpc.FutureTimeoutError:
+            raise Exception(f'channel not ready after {timeout}s')
+
+def warm_up():
+    """Import the provider SDKs and PIL, create the shared clients and open their channels"""
+    timeout = app.config['WARM_UP_TIMEOUT']
+    started = time.perf_counter()
+    with startup_step('warm_up_pil'):
         import PIL.Image
-        image = PIL.Image.open(io.BytesIO(image_data))
+        PIL.Image.init()
+    try:
+        with startup_step('warm_up_vision'):
+            open_channel(get_vision_client(), timeout)
+    except Exception as e:
+        print(f"[WARNING] Vision warm-up failed: {e}")
+    if GEMINI_API_KEY:
+        try:
+            with startup_step('warm_up_gemini'):
+                get_gemini_model()
+                if not app.config['FAKE_PROVIDERS']:
+                    # The model fetches this process-wide client on its first call
+                    from google.generativeai import client as genai_client
+                    open_channel(genai_client.get_default_generative_client(), timeout)
+        except Exception as e:
+            print(f"[WARNING] Gemini warm-up failed: {e}")
+    print(f"[STARTUP] Warm-up finished in {(time.perf_counter() - started) * 1000:.0f}ms: "
+          + ', '.join(f"{name} {ms}ms" for name, ms in startup_timings.items() if name.startswith('warm_up_')))
+
+def parse_gemini_sections(lines):
+    """Walk the MAIN ITEM / ADDITIONAL ITEMS / DETAILED DESCRIPTION sections.
+    
+    Returns (main_item, additional_items, current_section), where
+    current_section is the section the last line belonged to.
+    """
+    # Parse the structured response format
+    main_item = None
+    additional_items = []
+    
+    current_section = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        
+        # Look for MAIN ITEM section
+        if 'MAIN ITEM:' in line.upper() or line.upper().startswith('MAIN ITEM'):
+            # Extract the description after "MAIN ITEM:"
+            main_item = line.split(':', 1)[1].strip() if ':' in line else line
+            current_section = 'main'
+            continue
+        elif current_section == 'main' and main_item and not line.upper().startswith('ADDITIONAL'):
+            # Continue building main item description
+            if line and not line.upper().startswith('EXAMPLE'):
+                main_item += ' ' + line
+        
+        # Look for ADDITIONAL ITEMS section
+        elif 'ADDITIONAL ITEMS:' in line.upper() or line.upper().startswith('ADDITIONAL ITEMS'):
+            current_section = 'additional'
+            additional_text = line.split(':', 1)[1].strip() if ':' in line else ''
+            if additional_text and additional_text.upper() != 'NONE':
+                additional_items.append(additional_text)
+            continue
+        elif current_section == 'additional' and not line.upper().startswith('DETAILED'):
+            if line and line.upper() != 'NONE' and not line.upper().startswith('EXAMPLE'):
+                additional_items.append(line)
+        
+        # If we find DETAILED DESCRIPTION, we can stop parsing structured format
+        elif 'DETAILED DESCRIPTION:' in line.upper():
+            current_section = 'detailed'
+            break
+    
+    return main_item, additional_items, current_section
+
+def build_gemini_items(main_item, additional_items):
+    """Turn parsed sections into result items, dropping fragments too short to be useful"""
+    detected_items = []
+    
+    # Add main item if found
+    if main_item and len(main_item) > 10:
+        detected_items.append({
+            'description': main_item,
+            'confidence': 95.0,
+            'type': 'gemini_main'
+        })
+    
+    # Add additional items
+    for item in additional_items:
+        if item and len(item) > 5 and item.upper() != 'NONE':
+            detected_items.append({
+                'description': item,
+                'confidence': 90.0,
+                'type': 'gemini_additional'
+            })
+    
+    return detected_items
+
+def parse_gemini_response(description_text):
+    """Extract result items from a complete Gemini response"""
+    main_item, additional_items, _ = parse_gemini_sections(description_text.split('\n'))
+    detected_items = build_gemini_items(main_item, additional_items)
+    
+    # If structured parsing didn't work, try to extract the most descriptive sentence
+    if not detected_items:
+        # Look for the longest, most descriptive sentence
+        sentences = [s.strip() for s in description_text.replace('\n', ' ').split('.') 
+                    if s.strip() and len(s.strip()) > 30]
+        
+        # Filter out generic terms
+        generic_terms = ['burger', 'cheeseburger', 'food', 'dish', 'meal']
+        descriptive_sentences = [s for s in sentences 
+                               if any(term in s.lower() for term in ['with', 'and', 'on', 'topped', 'served', 'includes'])
+                               and not all(term in s.lower() for term in generic_terms if len(s.split()) < 5)]
+        
+        if descriptive_sentences:
+            # Use the most descriptive sentence
+            main_desc = max(descriptive_sentences, key=len)
+            detected_items.append({
+                'description': main_desc + '.',
+                'confidence': 90.0,
+                'type': 'gemini_parsed'
+            })
+        else:
+            # Fallback: use the full description
+            detected_items.append({
+                'description': description_text[:300] + ('...' if len(description_text) > 300 else ''),
+                'confidence': 85.0,
+                'type': 'gemini_full'
+            })
+    
+    return detected_items
+
+def require_gemini_key():
+    if not GEMINI_API_KEY:
+        raise Exception(
+            'Gemini API key not found. Please set the GEMINI_API_KEY environment variable. '
+            'Get your API key from https://ai.google.dev/'
+        )
+
+def gemini_request(upload):
+    """(contents, generation_config) for the generate_content call on upload"""
+    # Prepare the image - raw bytes are sent as-is when the format allows it
+    image = upload.gemini_part()
+    if app.config['GEMINI_OUTPUT_MODE'] == 'compact':
+        return [gemini_compact_prompt(app.config['GEMINI_COMPACT_DESCRIPTION']), image], {
+            'max_output_tokens': app.config['GEMINI_MAX_OUTPUT_TOKENS'],
+            'temperature': 0
+        }
+    return [GEMINI_PROMPT, image], None
+
+def gemini_result(description_text):
+    """Parse a complete Gemini response into the analyze_food_with_gemini payload"""
+    if app.config['GEMINI_OUTPUT_MODE'] == 'compact':
+        debug_log(f"[DEBUG] Gemini compact response: {description_text[:500]}...")
+        try:
+            with timed('gemini_parse'):
+                detected_items, description = parse_gemini_compact(description_text)
+            return {
+                'items': detected_items,
+                'full_description': description,
+                'source': 'gemini'
+            }
+        except ValueError as parse_error:
+            # Fall through to the free-form parser below
+            app.logger.warning(f"Compact Gemini response not valid JSON ({parse_error}), using text parser")
+    else:
+        debug_log(f"[DEBUG] Gemini raw response: {description_text[:500]}...")  # Log first 500 chars
+    
+    # Parse the response
+    with timed('gemini_parse'):
+        detected_items = parse_gemini_response(description_text)
+    
+    return {
+        'items': detected_items,
+        'full_description': description_text,
+        'source': 'gemini'
+    }
+
+def gemini_call_options(model, timeout):
+    """generate_content keyword arguments that bound the call to timeout seconds. Only SDKs
+    with request_options take a timeout; on older ones (0.3.x) a call runs until Gemini answers."""
+    if timeout is None or 'request_options' not in inspect.signature(model.generate_content).parameters:
+        return {}
+    return {'request_options': {'timeout': max(0.1, timeout)}}
+
+def analyze_food_with_gemini(upload, timeout=None):
+    """Use Google Gemini API to get detailed food descriptions"""
+    try:
+        # Check if Gemini API key is configured
+        require_gemini_key()
+        
+        model = get_gemini_model()
+        contents, generation_config = gemini_request(upload)
         
         # Generate content
-        response = model.generate_content([prompt, image])
+        with timed('gemini_generate'):
+            response = model.generate_content(contents, generation_config=generation_config,
+                                              **gemini_call_options(model, timeout))
+            description_text = response.text
         
-        # Parse the response
-        description_text = response.text
-        print(f"[DEBUG] Gemini raw response: {description_text[:500]}...")  # Log first 500 chars
+        return gemini_result(description_text)
+    
+    except Exception as e:
+        raise Exception(f'Error analyzing food with Gemini: {str(e)}')
+
+async def analyze_food_with_gemini_async(upload):
+    """Async variant of analyze_food_with_gemini: waits on Gemini without holding a thread"""
+    try:
+        require_gemini_key()
         
-        # Extract structured information
-        detected_items = []
+        model = get_gemini_model()
+        contents, generation_config = gemini_request(upload)
         
-        # Parse the structured response format
-        lines = description_text.split('\n')
-        main_item = None
-        additional_items = []
+        with timed('gemini_generate'):
+            response = await model.generate_content_async(contents, generation_config=generation_config)
+            description_text = response.text
         
-        current_section = None
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Look for MAIN ITEM section
-            if 'MAIN ITEM:' in line.upper() or line.upper().startswith('MAIN ITEM'):
-                # Extract the description after "MAIN ITEM:"
-                main_item = line.split(':', 1)[1].strip() if ':' in line else line
-                current_section = 'main'
+        return gemini_result(description_text)
+    
+    except Exception as e:
+        raise Exception(f'Error analyzing food with Gemini: {str(e)}')
+
+def analyze_food_with_gemini_stream(upload):
+    """Streaming variant of analyze_food_with_gemini.
+    
+    Yields ('item', item) as soon as each item's section is complete in the
+    streamed text, then ('result', result) with the same payload that
+    analyze_food_with_gemini returns. Compact responses are JSON, so their
+    items are only yielded once the whole response has arrived.
+    """
+    try:
+        require_gemini_key()
+        
+        model = get_gemini_model()
+        contents, generation_config = gemini_request(upload)
+        response = model.generate_content(contents, generation_config=generation_config, stream=True)
+        compact = app.config['GEMINI_OUTPUT_MODE'] == 'compact'
+        
+        description_text = ''
+        emitted = 0
+        for chunk in response:
+            description_text += chunk.text
+            if compact:
                 continue
-            elif current_section == 'main' and main_item and not line.upper().startswith('ADDITIONAL'):
-                # Continue building main item description
-                if line and not line.upper().startswith('EXAMPLE'):
-                    main_item += ' ' + line
             
-            # Look for ADDITIONAL ITEMS section
-            elif 'ADDITIONAL ITEMS:' in line.upper() or line.upper().startswith('ADDITIONAL ITEMS'):
-                current_section = 'additional'
-                additional_text = line.split(':', 1)[1].strip() if ':' in line else ''
-                if additional_text and additional_text.upper() != 'NONE':
-                    additional_items.append(additional_text)
+            # Only parse whole lines; the last line may still be growing
+            complete_lines = description_text[:description_text.rfind('\n') + 1].split('\n')
+            main_item, additional_items, current_section = parse_gemini_sections(complete_lines)
+            if current_section == 'main':
+                # The main item can continue onto following lines until the next section starts
                 continue
-            elif current_section == 'additional' and not line.upper().startswith('DETAILED'):
-                if line and line.upper() != 'NONE' and not line.upper().startswith('EXAMPLE'):
-                    additional_items.append(line)
-            
-            # If we find DETAILED DESCRIPTION, we can stop parsing structured format
-            elif 'DETAILED DESCRIPTION:' in line.upper():
-                current_section = 'detailed'
-                break
+            items = build_gemini_items(main_item, additional_items)
+            for item in items[emitted:]:
+                yield 'item', item
+            emitted = max(emitted, len(items))
         
-        # Add main item if found
-        if main_item and len(main_item) > 10:
-            detected_items.append({
-                'description': main_item,
-                'confidence': 95.0,
-                'type': 'gemini_main'
-            })
-        
-        # Add additional items
-        for item in additional_items:
-            if item and len(item) > 5 and item.upper() != 'NONE':
-                detected_items.append({
-                    'description': item,
-                    'confidence': 90.0,
-                    'type': 'gemini_additional'
-                })
+        result = gemini_result(description_text)
+        for item in result['items'][emitted:]:
+            yield 'item', item
+        yield 'result', result
+    
+    except Exception as e:
+        raise Exception(f'Error analyzing food with Gemini: {str(e)}')
+
+def submit_gemini(fn, *args):
+    """Submit a Gemini call to its pool. Returns (future, queued), queued being True if all
+    the pool's workers were already busy (with live or abandoned calls)."""
+    global gemini_calls_pending
+    
+    def finished(_):
+        global gemini_calls_pending
+        with _gemini_pending_lock:
+            gemini_calls_pending -= 1
+    
+    with _gemini_pending_lock:
+        queued = gemini_calls_pending >= app.config['PROVIDER_WORKERS']
+        gemini_calls_pending += 1
+    future = gemini_executor.submit(fn, *args)
+    future.add_done_callback(finished)
+    return future, queued
+
+def run_hedged(upload, cache_info, mode):
+    """Run Gemini with Vision as a hedge under one overall deadline.
+    
+    Returns (gemini_result, vision_items, hedge_info); exactly one of the
+    first two is set. Raises if neither provider succeeds in time.
+    """
+    started = time.monotonic()
+    deadline = started + app.config['REQUEST_DEADLINE']
+    hedge_info = {'mode': mode}
+    
+    gemini_future, gemini_queued = submit_gemini(
+        cached_call, 'gemini', upload,
+        lambda: analyze_food_with_gemini(provider_image(upload, 'gemini'), timeout=deadline - time.monotonic()),
+        cache_info)
+    vision_future = None
+    
+    def start_vision():
+        hedge_info['vision_started_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return vision_executor.submit(
+            cached_call, 'vision', upload, lambda: detect_food_items(provider_image(upload, 'vision')), cache_info)
+    
+    if gemini_queued:
+        # Every Gemini worker is busy, so the call would wait before it even starts
+        hedge_info['gemini_queued'] = True
+    if mode == 'parallel' or gemini_queued:
+        vision_future = start_vision()
+    else:
+        wait([gemini_future], timeout=min(app.config['HEDGE_DELAY'], app.config['REQUEST_DEADLINE']))
+        if not gemini_future.done() or gemini_future.exception() is not None:
+            vision_future = start_vision()
+    
+    gemini_error = None
+    while True:
+        if gemini_future.done():
+            gemini_error = gemini_future.exception()
+            if gemini_error is None:
+                if vision_future is not None:
+                    vision_future.cancel()  # no-op if already running; its result is just ignored
+                hedge_info['winner'] = 'gemini'
+                break
+            if vision_future is None:
+                vision_future = start_vision()
         
-        # If structured parsing didn't work, try to extract the most descriptive sentence
-        if not detected_items:
-            # Look for the longest, most descriptive sentence
-            sentences = [s.strip() for s in description_text.replace('\n', ' ').split('.') 
-                        if s.strip() and len(s.strip()) > 30]
-            
-            # Filter out generic terms
-            generic_terms = ['burger', 'cheeseburger', 'food', 'dish', 'meal']
-            descriptive_sentences = [s for s in sentences 
-                                   if any(term in s.lower() for term in ['with', 'and', 'on', 'topped', 'served', 'includes'])
-                                   and not all(term in s.lower() for term in generic_terms if len(s.split()) < 5)]
-            
-            if descriptive_sentences:
-                # Use the most descriptive sentence
-                main_desc = max(descriptive_sentences, key=len)
-                detected_items.append({
-                    'description': main_desc + '.',
-                    'confidence': 90.0,
-                    'type': 'gemini_parsed'
-                })
-            else:
-                # Fallback: use the full description
-                detected_items.append({
-                    'description': description_text[:300] + ('...' if len(description_text) > 300 else ''),
-                    'confidence': 85.0,
-                    'type': 'gemini_full'
-                })
+        # Gemini is preferred, so a finished Vision call only wins once Gemini has failed or time is up
+        if gemini_error is not None and vision_future.done():
+            break
         
-        return {
-            'items': detected_items,
-            'full_description': description_text,
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        pending = [f for f in (gemini_future, vision_future) if f is not None and not f.done()]
+        if not pending:
+            continue
+        wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+    
+    hedge_info['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+    if hedge_info.get('winner') == 'gemini':
+        return gemini_future.result(), [], hedge_info
+    
+    if gemini_error is None:
+        gemini_future.cancel()
+        hedge_info['gemini_timed_out'] = True
+    else:
+        hedge_info['gemini_error'] = str(gemini_error)
+        hedge_info['fallback_reason'] = fallback_reason(gemini_error)
+    
+    if vision_future is not None and vision_future.done() and vision_future.exception() is None:
+        hedge_info['winner'] = 'vision'
+        return None, vision_future.result(), hedge_info
+    
+    if vision_future is not None and vision_future.done():
+        raise Exception(f'Vision API fallback failed: {vision_future.exception()}')
+    raise Exception(f"No provider answered within the {app.config['REQUEST_DEADLINE']}s deadline")
+
+def analysis_debug_info(use_gemini):
+    """Whether to try Gemini first, and the debug block describing why"""
+    # Debug: Check API key status
+    condition_result = bool(use_gemini and GEMINI_API_KEY)
+    debug_info = {
+        'gemini_key_present': GEMINI_API_KEY is not None,
+        'gemini_key_value': GEMINI_API_KEY[:20] + '...' if GEMINI_API_KEY else 'None',
+        'use_gemini_flag': use_gemini,
+        'env_key_set': bool(os.environ.get('GEMINI_API_KEY')),
+        'condition_result': condition_result,
+        'gemini_key_type': type(GEMINI_API_KEY).__name__ if GEMINI_API_KEY else 'None'
+    }
+    debug_log(f"[UPLOAD] Condition: use_gemini={use_gemini}, GEMINI_API_KEY={bool(GEMINI_API_KEY)}, Combined={condition_result}")
+    return condition_result, debug_info
+
+def record_hedge(debug_info, hedge_info):
+    """Fold a hedged run's outcome into the debug block and fallback metrics"""
+    debug_info['hedge'] = hedge_info
+    if 'gemini_error' in hedge_info:
+        debug_info['gemini_error'] = hedge_info['gemini_error']
+    if hedge_info['winner'] == 'vision':
+        FALLBACKS.inc(reason=hedge_info.get('fallback_reason', 'gemini_deadline'))
+    debug_log(f"[UPLOAD] Hedged analysis ({hedge_info['mode']}): {hedge_info['winner']} won after {hedge_info['elapsed_ms']}ms")
+
+def record_vision_only():
+    """Count and log why Gemini was skipped"""
+    # Use Vision API if Gemini is not available or disabled
+    if not GEMINI_API_KEY:
+        FALLBACKS.inc(reason='no_api_key')
+        debug_log("[UPLOAD] Gemini API key not set, using Vision API only")
+    else:
+        FALLBACKS.inc(reason='gemini_disabled')
+        debug_log("[UPLOAD] Gemini disabled by request, using Vision API")
+
+def analysis_payload(upload, gemini_result, vision_items, debug_info, cache_info):
+    """The /upload response body, with debug info only when verbose logging is on"""
+    if gemini_result:
+        result = {
+            'success': True,
+            'items': gemini_result['items'],
+            'full_description': gemini_result.get('full_description', ''),
+            'count': len(gemini_result['items']),
             'source': 'gemini'
         }
+    else:
+        result = {
+            'success': True,
+            'items': vision_items,
+            'count': len(vision_items),
+            'source': 'vision_api'
+        }
     
-    except Exception as e:
-        raise Exception(f'Error analyzing food with Gemini: {str(e)}')
+    if app.config['VERBOSE_LOGGING']:
+        cache_info.update(result_cache.snapshot())
+        debug_info['cache'] = cache_info
+        debug_info['normalization'] = upload.variant_stats
+        result['debug'] = debug_info
+    return result
+
+def analyze_image(upload, use_gemini):
+    """Run the Gemini-then-Vision analysis on an upload and return the response payload"""
+    cache_info = {}
+    gemini_result = None
+    vision_items = []
+    condition_result, debug_info = analysis_debug_info(use_gemini)
+    
+    if condition_result and app.config['ANALYSIS_MODE'] in ('hedged', 'parallel'):
+        gemini_result, vision_items, hedge_info = run_hedged(upload, cache_info, app.config['ANALYSIS_MODE'])
+        record_hedge(debug_info, hedge_info)
+    elif condition_result:
+        try:
+            debug_log("[UPLOAD] Attempting to use Gemini API")
+            gemini_result = cached_call('gemini', upload, lambda: analyze_food_with_gemini(provider_image(upload, 'gemini')), cache_info)
+            debug_log(f"[UPLOAD] SUCCESS: Gemini API returned {len(gemini_result.get('items', []))} items, "
+                      f"description length {len(gemini_result.get('full_description', ''))}")
+        except Exception as gemini_error:
+            # Fall back to Vision API if Gemini fails
+            app.logger.error(f"Gemini API error, falling back to Vision API: {str(gemini_error)}")
+            FALLBACKS.inc(reason=fallback_reason(gemini_error))
+            with timed('vision_fallback'):
+                vision_items = cached_call('vision', upload, lambda: detect_food_items(provider_image(upload, 'vision')), cache_info)
+            debug_log(f"[UPLOAD] Using Vision API results: {len(vision_items)} items")
+            debug_info['gemini_error'] = str(gemini_error)
+    else:
+        record_vision_only()
+        vision_items = cached_call('vision', upload, lambda: detect_food_items(provider_image(upload, 'vision')), cache_info)
+        debug_log(f"[UPLOAD] Using Vision API results: {len(vision_items)} items")
+    
+    return analysis_payload(upload, gemini_result, vision_items, debug_info, cache_info)
+
+async def cached_call_async(kind, upload, compute, cache_info):
+    """cached_call for a coroutine function; hashing and cache I/O run off the event loop"""
+    result, hit_type, keys = await asyncio.to_thread(cache_lookup, kind, upload, cache_info)
+    if hit_type:
+        return result
+    await admit_async(kind)
+    try:
+        result = await compute()
+    except Exception:
+        record_outcome(kind, False)
+        raise
+    except BaseException:
+        # CancelledError: the hedge gave up on this call
+        record_cancelled(kind)
+        raise
+    record_outcome(kind, True)
+    await asyncio.to_thread(result_cache.put, cache_kind(kind), keys, result)
+    return result
+
+async def gemini_analysis_async(upload):
+    # Normalizing is CPU work, so it runs on a thread; the provider wait does not
+    return await analyze_food_with_gemini_async(await asyncio.to_thread(provider_image, upload, 'gemini'))
+
+async def vision_analysis_async(upload):
+    return await detect_food_items_async(await asyncio.to_thread(provider_image, upload, 'vision'))
+
+async def run_hedged_async(upload, cache_info, mode):
+    """Async variant of run_hedged. The losing call is cancelled rather than left running."""
+    started = time.monotonic()
+    deadline = started + app.config['REQUEST_DEADLINE']
+    hedge_info = {'mode': mode}
+    
+    gemini_task = asyncio.ensure_future(
+        cached_call_async('gemini', upload, lambda: gemini_analysis_async(upload), cache_info))
+    vision_task = None
+    
+    def start_vision():
+        hedge_info['vision_started_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return asyncio.ensure_future(
+            cached_call_async('vision', upload, lambda: vision_analysis_async(upload), cache_info))
+    
+    if mode == 'parallel':
+        vision_task = start_vision()
+    else:
+        await asyncio.wait([gemini_task], timeout=min(app.config['HEDGE_DELAY'], app.config['REQUEST_DEADLINE']))
+        if not gemini_task.done() or gemini_task.exception() is not None:
+            vision_task = start_vision()
+    
+    gemini_error = None
+    while True:
+        if gemini_task.done():
+            gemini_error = gemini_task.exception()
+            if gemini_error is None:
+                if vision_task is not None:
+                    vision_task.cancel()
+                hedge_info['winner'] = 'gemini'
+                break
+            if vision_task is None:
+                vision_task = start_vision()
+        
+        # Gemini is preferred, so a finished Vision call only wins once Gemini has failed or time is up
+        if gemini_error is not None and vision_task.done():
+            break
+        
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        pending = [t for t in (gemini_task, vision_task) if t is not None and not t.done()]
+        if not pending:
+            continue
+        await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+    
+    hedge_info['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+    if hedge_info.get('winner') == 'gemini':
+        return gemini_task.result(), [], hedge_info
+    
+    if gemini_error is None:
+        gemini_task.cancel()
+        hedge_info['gemini_timed_out'] = True
+    else:
+        hedge_info['gemini_error'] = str(gemini_error)
+        hedge_info['fallback_reason'] = fallback_reason(gemini_error)
+    
+    if vision_task is not None and vision_task.done() and vision_task.exception() is None:
+        hedge_info['winner'] = 'vision'
+        return None, vision_task.result(), hedge_info
+    
+    if vision_task is not None and vision_task.done():
+        raise Exception(f'Vision API fallback failed: {vision_task.exception()}')
+    if vision_task is not None:
+        vision_task.cancel()
+    raise Exception(f"No provider answered within the {app.config['REQUEST_DEADLINE']}s deadline")
+
+async def analyze_image_async(upload, use_gemini):
+    """Async variant of analyze_image, used by the ASGI /upload route (see asgi.py)"""
+    cache_info = {}
+    gemini_result = None
+    vision_items = []
+    condition_result, debug_info = analysis_debug_info(use_gemini)
+    
+    if condition_result and app.config['ANALYSIS_MODE'] in ('hedged', 'parallel'):
+        gemini_result, vision_items, hedge_info = await run_hedged_async(upload, cache_info, app.config['ANALYSIS_MODE'])
+        record_hedge(debug_info, hedge_info)
+    elif condition_result:
+        try:
+            gemini_result = await cached_call_async('gemini', upload, lambda: gemini_analysis_async(upload), cache_info)
+        except Exception as gemini_error:
+            app.logger.error(f"Gemini API error, falling back to Vision API: {str(gemini_error)}")
+            FALLBACKS.inc(reason=fallback_reason(gemini_error))
+            with timed('vision_fallback'):
+                vision_items = await cached_call_async('vision', upload, lambda: vision_analysis_async(upload), cache_info)
+            debug_info['gemini_error'] = str(gemini_error)
+    else:
+        record_vision_only()
+        vision_items = await cached_call_async('vision', upload, lambda: vision_analysis_async(upload), cache_info)
+    
+    return analysis_payload(upload, gemini_result, vision_items, debug_info, cache_info)
+
+def history_context(headers, values):
+    """(user_id, utc_offset_minutes) to log a request's meal under: the user from the trusted
+    HISTORY_USER_HEADER (None if unset or missing), and the utc_offset_minutes field that
+    decides which local day it falls on"""
+    user_header = app.config['HISTORY_USER_HEADER']
+    user_id = (headers.get(user_header.lower()) or None) if user_header else None
+    if user_id:
+        user_id = user_id[:128]
+    try:
+        utc_offset = max(-14 * 60, min(14 * 60, int(values.get('utc_offset_minutes') or 0)))
+    except ValueError:
+        utc_offset = 0
+    return user_id, utc_offset
+
+def record_meal(context, result, filename):
+    """Queue a successful analysis for the meal history; never blocks the request"""
+    if meal_history is None or not result or not result.get('success'):
+        return
+    user_id, utc_offset = context
+    if user_id is None:
+        return
+    if not meal_history.record(user_id, result, filename, utc_offset):
+        print(f"[HISTORY] Write queue full, meal for {user_id} not logged")
+
+def record_job_meal(job):
+    if job['status'] == 'done' and job.get('history'):
+        record_meal(job['history'], job['result'], job.get('filename'))
+
+def run_analysis_job(upload, use_gemini):
+    """Job body: analyze an in-memory upload"""
+    return analyze_image(upload, use_gemini)
+
+@app.before_request
+def start_request_metrics():
+    request.metrics_started = time.perf_counter()
+    IN_FLIGHT.inc(endpoint=request.endpoint or 'unknown')
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    # Streaming responses are still being generated here, so this only times their setup
+    REQUEST_SECONDS.observe(time.perf_counter() - request.metrics_started, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if hasattr(request, 'metrics_started'):
+        IN_FLIGHT.dec(endpoint=request.endpoint or 'unknown')
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    return jsonify(rejection_payload(e)), e.status
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    UPLOAD_REJECTIONS.inc(reason='body_too_large')
+    return jsonify({'error': f"File too large. Maximum is {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)}MB",
+                    'reason': 'body_too_large'}), 413
 
 @app.route('/')
 def index():
     """Render the main page"""
-    print(f"[ROUTE] Index page requested")
-    return render_template('index.html')
+    debug_log(f"[ROUTE] Index page requested")
+    return render_template('index.html', client_resize=app.config['CLIENT_RESIZE'])
 
 @app.route('/test')
 def test_route():
     """Test route to verify Flask is working"""
-    print(f"[ROUTE] Test route called")
+    debug_log(f"[ROUTE] Test route called")
     return jsonify({'status': 'ok', 'message': 'Flask is working'})
 
 @app.route('/api/status')
@@ -330,142 +1442,375 @@ def api_status():
         'gemini_api_key_set': GEMINI_API_KEY is not None,
         'gemini_api_key_preview': GEMINI_API_KEY[:20] + '...' if GEMINI_API_KEY else None,
         'vision_api_configured': os.environ.get('GOOGLE_APPLICATION_CREDENTIALS') is not None,
-        'environment_gemini_key': 'SET' if os.environ.get('GEMINI_API_KEY') else 'NOT SET'
+        'environment_gemini_key': 'SET' if os.environ.get('GEMINI_API_KEY') else 'NOT SET',
+        'providers': {kind: scheduler.snapshot() for kind, scheduler in provider_schedulers.items()},
+        'history': meal_history.snapshot() if meal_history else None,
+        'startup_ms': startup_timings
     })
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint: stage latency histograms and request/provider counters"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def history_page_size():
+    limit = request.args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int)
+    return max(1, min(limit, app.config['HISTORY_MAX_PAGE_SIZE']))
+
+def history_reader():
+    """(user_id, None) for a history read, or (None, error response) if it isn't allowed"""
+    if meal_history is None or not app.config['HISTORY_USER_HEADER']:
+        return None, (jsonify({'error': 'Meal history is disabled on this server'}), 404)
+    user_id, _ = history_context(request.headers, {})
+    if user_id is None:
+        return None, (jsonify({'error': 'Meal history requires an authenticated user'}), 401)
+    return user_id, None
+
+@app.route('/api/history')
+def api_history():
+    """A page of the user's logged meals, newest first. Pass next_cursor back as cursor
+    for the next page; day=YYYY-MM-DD limits it to one local day."""
+    user_id, error = history_reader()
+    if error:
+        return error
+    try:
+        meals, next_cursor = meal_history.meals(user_id, limit=history_page_size(), cursor=request.args.get('cursor'),
+                                                day=request.args.get('day'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({'user_id': user_id, 'meals': meals, 'count': len(meals), 'next_cursor': next_cursor})
+
+@app.route('/api/history/daily')
+def api_history_daily():
+    """The user's daily summaries (meals, item counts), most recent day first, paginated like /api/history"""
+    user_id, error = history_reader()
+    if error:
+        return error
+    days, next_cursor = meal_history.daily_summaries(user_id, limit=history_page_size(), before=request.args.get('cursor'))
+    return jsonify({'user_id': user_id, 'days': days, 'count': len(days), 'next_cursor': next_cursor})
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     """Handle file upload and process with Gemini API (with Vision API fallback)"""
-    # Use Flask logger which definitely shows up
-    app.logger.info("===== Upload request received =====")
-    app.logger.info(f"Request method: {request.method}")
-    app.logger.info(f"Files in request: {list(request.files.keys())}")
-    
-    # Also print to stdout
-    import sys
-    print(f"\n[UPLOAD] ===== Upload request received =====", file=sys.stderr, flush=True)
-    print(f"[UPLOAD] Request method: {request.method}", file=sys.stderr, flush=True)
-    print(f"[UPLOAD] Files in request: {list(request.files.keys())}", file=sys.stderr, flush=True)
+    # Receiving = parsing the multipart body into request.files
+    with timed('receive'):
+        files = request.files
+    debug_log(f"[UPLOAD] Upload request received, files in request: {list(files.keys())}")
     
-    if 'file' not in request.files:
-        print(f"[UPLOAD] ERROR: No file in request")
-        return jsonify({'error': 'No file provided'}), 400
+    error = upload_file_error(files)
+    if error:
+        debug_log(f"[UPLOAD] ERROR: {error}")
+        return jsonify({'error': error}), 400
     
-    file = request.files['file']
-    print(f"[UPLOAD] File received: {file.filename}")
+    file = files['file']
+    debug_log(f"[UPLOAD] File received: {file.filename}")
     
-    if file.filename == '':
-        print(f"[UPLOAD] ERROR: Empty filename")
-        return jsonify({'error': 'No file selected'}), 400
-    
-    if not allowed_file(file.filename):
-        print(f"[UPLOAD] ERROR: Invalid file type")
-        return jsonify({'error': 'Invalid file type. Please upload an image (PNG, JPG, JPEG, GIF, WEBP)'}), 400
+    # Read the upload into memory once; every stage shares this buffer (rejections go to upload_rejected)
+    upload = read_upload(file)
+    debug_log(f"[UPLOAD] File read into memory: {len(upload.data)} bytes")
     
     try:
-        # Save the uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        print(f"[UPLOAD] File saved to: {filepath}")
-        
         # Try Gemini API first (for detailed descriptions)
         use_gemini = request.form.get('use_gemini', 'true').lower() == 'true'
-        gemini_result = None
-        vision_items = []
+        result = analyze_image(upload, use_gemini)
+        record_meal(history_context(request.headers, request.form), result, file.filename)
         
-        # Debug: Check API key status
-        condition_result = bool(use_gemini and GEMINI_API_KEY)
-        debug_info = {
-            'gemini_key_present': GEMINI_API_KEY is not None,
-            'gemini_key_value': GEMINI_API_KEY[:20] + '...' if GEMINI_API_KEY else 'None',
-            'use_gemini_flag': use_gemini,
-            'env_key_set': bool(os.environ.get('GEMINI_API_KEY')),
-            'condition_result': condition_result,
-            'gemini_key_type': type(GEMINI_API_KEY).__name__ if GEMINI_API_KEY else 'None'
-        }
-        
-        app.logger.info(f"===== Checking API Status =====")
-        app.logger.info(f"GEMINI_API_KEY present: {debug_info['gemini_key_present']}")
-        app.logger.info(f"GEMINI_API_KEY value: {debug_info['gemini_key_value']}")
-        app.logger.info(f"use_gemini flag: {use_gemini}")
-        app.logger.info(f"Condition check: use_gemini={use_gemini}, GEMINI_API_KEY={bool(GEMINI_API_KEY)}, Combined={use_gemini and GEMINI_API_KEY}")
+        return jsonify(result)
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/stream', methods=['POST'])
+def upload_stream():
+    """Like /upload, but streams results as Server-Sent Events.
+    
+    Emits an 'item' event for each item as soon as it is known, 'status' events
+    for fallbacks, and finally a 'done' event carrying the full /upload payload
+    (or an 'error' event).
+    """
+    error = upload_file_error(request.files)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    file = request.files['file']
+    upload = read_upload(file)
+    use_gemini = request.form.get('use_gemini', 'true').lower() == 'true'
+    debug_log(f"[STREAM] Streaming analysis for {file.filename} ({len(upload.data)} bytes)")
+    history = history_context(request.headers, request.form)
+    
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    def fallback_status(gemini_error):
+        # Like /upload, the provider's error text is only shown with verbose logging on
+        status = {'message': 'Gemini unavailable, falling back to Vision API'}
+        if app.config['VERBOSE_LOGGING']:
+            status['gemini_error'] = gemini_error
+        return sse('status', status)
+    
+    def generate():
+        cache_info = {}
+        condition_result, debug_info = analysis_debug_info(use_gemini)
+
+        if condition_result and app.config['ANALYSIS_MODE'] in ('hedged', 'parallel'):
+            # Items can't be streamed from a hedged run, but it keeps the hedge and the deadline
+            try:
+                gemini_result, vision_items, hedge_info = run_hedged(upload, cache_info, app.config['ANALYSIS_MODE'])
+            except Exception as e:
+                yield sse('error', {'error': str(e)})
+                return
+            record_hedge(debug_info, hedge_info)
+            done = analysis_payload(upload, gemini_result, vision_items, debug_info, cache_info)
+            if hedge_info['winner'] == 'vision':
+                yield fallback_status(hedge_info.get('gemini_error', 'deadline exceeded'))
+            for item in done['items']:
+                yield sse('item', item)
+            record_meal(history, done, file.filename)
+            yield sse('done', done)
+            return
+
+        if condition_result:
+            cached, hit_type, keys = cache_lookup('gemini', upload, cache_info)
+            try:
+                if hit_type:
+                    gemini_result = cached
+                    for item in gemini_result['items']:
+                        yield sse('item', item)
+                else:
+                    gemini_result = None
+                    admit('gemini')
+                    try:
+                        with timed('gemini_stream'):
+                            for kind, payload in analyze_food_with_gemini_stream(provider_image(upload, 'gemini')):
+                                if kind == 'item':
+                                    yield sse('item', payload)
+                                else:
+                                    gemini_result = payload
+                    except Exception:
+                        record_outcome('gemini', False)
+                        raise
+                    except BaseException:
+                        # GeneratorExit: the client disconnected mid-stream
+                        record_cancelled('gemini')
+                        raise
+                    record_outcome('gemini', True)
+                    result_cache.put(cache_kind('gemini'), keys, gemini_result)
+                
+                done = analysis_payload(upload, gemini_result, [], debug_info, cache_info)
+                record_meal(history, done, file.filename)
+                yield sse('done', done)
+                return
+            except Exception as e:
+                debug_info['gemini_error'] = str(e)
+                FALLBACKS.inc(reason=fallback_reason(e))
+                app.logger.error(f"Gemini API error, falling back to Vision API: {str(e)}")
+                yield fallback_status(str(e))
         
-        # Also print to stderr
-        import sys
-        print(f"[UPLOAD] ===== Checking API Status =====", file=sys.stderr, flush=True)
-        print(f"[UPLOAD] Condition: {debug_info['condition_result']}", file=sys.stderr, flush=True)
+        else:
+            record_vision_only()
         
-        app.logger.info(f"About to check condition_result: {condition_result} (type: {type(condition_result)})")
+        try:
+            vision_items = cached_call('vision', upload, lambda: detect_food_items(provider_image(upload, 'vision')), cache_info)
+        except Exception as e:
+            yield sse('error', {'error': str(e)})
+            return
         
-        if condition_result:
-            app.logger.info("===== ENTERING GEMINI BLOCK =====")
+        for item in vision_items:
+            yield sse('item', item)
+        done = analysis_payload(upload, None, vision_items, debug_info, cache_info)
+        record_meal(history, done, file.filename)
+        yield sse('done', done)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """Handle many files in one request: Gemini analyses fan out concurrently,
+    Vision work (fallback or Gemini disabled) goes through one batch annotate call"""
+    # A file that fails screening gets its own error entry instead of failing the batch
+    request.abort_on_rejected_upload = False
+    files = request.files.getlist('files') or request.files.getlist('file')
+    debug_log(f"[BATCH] Upload batch received: {len(files)} files")
+    
+    if not files:
+        return jsonify({'error': 'No files provided'}), 400
+    
+    if len(files) > app.config['BATCH_MAX_FILES']:
+        return jsonify({'error': f"Too many files. Maximum is {app.config['BATCH_MAX_FILES']} per batch"}), 400
+    
+    use_gemini = request.form.get('use_gemini', 'true').lower() == 'true'
+    use_gemini = bool(use_gemini and GEMINI_API_KEY)
+    
+    # One slot per input file, filled in as each stage completes
+    results = [None] * len(files)
+    entries = []
+    for index, file in enumerate(files):
+        if file.filename == '':
+            results[index] = {'filename': file.filename, 'error': 'No file selected'}
+        elif not allowed_file(file.filename):
+            results[index] = {'filename': file.filename, 'error': 'Invalid file type. Please upload an image (PNG, JPG, JPEG, GIF, WEBP)'}
+        else:
             try:
-                app.logger.info("===== Attempting to use Gemini API =====")
-                print(f"[UPLOAD] ===== Attempting to use Gemini API =====", file=sys.stderr, flush=True)
-                gemini_result = analyze_food_with_gemini(filepath)
-                app.logger.info(f"SUCCESS: Gemini API succeeded! Returned {len(gemini_result.get('items', []))} items")
-                print(f"[UPLOAD] SUCCESS: Gemini API succeeded! Returned {len(gemini_result.get('items', []))} items", file=sys.stderr, flush=True)
-                print(f"[UPLOAD] Full description length: {len(gemini_result.get('full_description', ''))}", file=sys.stderr, flush=True)
-            except Exception as gemini_error:
-                # Fall back to Vision API if Gemini fails
-                app.logger.error(f"ERROR: Gemini API error, falling back to Vision API: {str(gemini_error)}")
-                print(f"[UPLOAD] ERROR: Gemini API error, falling back to Vision API", file=sys.stderr, flush=True)
-                print(f"[UPLOAD] Error details: {str(gemini_error)}", file=sys.stderr, flush=True)
-                import traceback
-                traceback.print_exc()
-                vision_items = detect_food_items(filepath)
-                print(f"[UPLOAD] Using Vision API results: {len(vision_items)} items", file=sys.stderr, flush=True)
-                debug_info['gemini_error'] = str(gemini_error)
+                upload = read_upload(file)
+            except UploadRejected as rejection:
+                results[index] = dict(rejection_payload(rejection), filename=file.filename)
+                continue
+            entries.append({'index': index, 'filename': file.filename, 'upload': upload, 'cache': {}})
+    
+    vision_entries = entries
+    if use_gemini:
+        def run_gemini(entry):
+            return cached_call('gemini', entry['upload'],
+                               lambda: analyze_food_with_gemini(provider_image(entry['upload'], 'gemini')),
+                               entry['cache'])
+        
+        vision_entries = []
+        with ThreadPoolExecutor(max_workers=app.config['BATCH_CONCURRENCY']) as executor:
+            futures = [(entry, executor.submit(run_gemini, entry)) for entry in entries]
+            for entry, future in futures:
+                try:
+                    gemini_result = future.result()
+                    results[entry['index']] = {
+                        'filename': entry['filename'],
+                        'success': True,
+                        'items': gemini_result['items'],
+                        'full_description': gemini_result.get('full_description', ''),
+                        'count': len(gemini_result['items']),
+                        'source': 'gemini'
+                    }
+                except Exception as gemini_error:
+                    debug_log(f"[BATCH] Gemini failed for {entry['filename']}, falling back to Vision API: {gemini_error}")
+                    FALLBACKS.inc(reason=fallback_reason(gemini_error))
+                    entry['gemini_error'] = str(gemini_error)
+                    vision_entries.append(entry)
+    
+    # Serve Vision results from the cache where possible; batch the rest
+    pending = []
+    for entry in vision_entries:
+        cached, hit_type, keys = cache_lookup('vision', entry['upload'], entry['cache'])
+        if hit_type:
+            entry['vision_items'] = cached
         else:
-            # Use Vision API if Gemini is not available or disabled
-            app.logger.warning("===== ENTERING VISION API BLOCK (condition_result is False) =====")
-            print(f"[UPLOAD] ===== ENTERING VISION API BLOCK =====", file=sys.stderr, flush=True)
-            if not GEMINI_API_KEY:
-                app.logger.warning("Gemini API key not set, using Vision API only")
-                print(f"[UPLOAD] ERROR: Gemini API key not set, using Vision API only", file=sys.stderr, flush=True)
-                print(f"[UPLOAD] GEMINI_API_KEY value: {GEMINI_API_KEY}", file=sys.stderr, flush=True)
-                print(f"[UPLOAD] Environment variable: {os.environ.get('GEMINI_API_KEY', 'NOT FOUND')}", file=sys.stderr, flush=True)
+            entry['cache_keys'] = keys
+            pending.append(entry)
+    
+    # Each image needs a Vision token; once the budget runs out the rest are refused without waiting
+    admitted = []
+    refusal = None
+    for entry in pending:
+        if refusal is None:
+            try:
+                admit('vision')
+                admitted.append(entry)
+                continue
+            except ProviderUnavailable as e:
+                refusal = str(e)
+        entry['vision_error'] = f'Error detecting food items: {refusal}'
+    
+    if admitted:
+        batch_results = detect_food_items_batch([provider_image(entry['upload'], 'vision') for entry in admitted])
+        for entry, outcome in zip(admitted, batch_results):
+            if isinstance(outcome, Exception):
+                record_outcome('vision', False)
+                entry['vision_error'] = str(outcome)
             else:
-                app.logger.warning("Gemini disabled by request, using Vision API")
-                print(f"[UPLOAD] Gemini disabled by request, using Vision API", file=sys.stderr, flush=True)
-            vision_items = detect_food_items(filepath)
-            print(f"[UPLOAD] Using Vision API results: {len(vision_items)} items", file=sys.stderr, flush=True)
-        
-        # Clean up uploaded file
-        os.remove(filepath)
-        
-        # Return results with debug info
-        if gemini_result:
-            app.logger.info(f"===== Returning Gemini results =====")
-            app.logger.info(f"Items count: {len(gemini_result['items'])}")
-            return jsonify({
+                record_outcome('vision', True)
+                result_cache.put(cache_kind('vision'), entry['cache_keys'], outcome)
+                entry['vision_items'] = outcome
+    
+    for entry in vision_entries:
+        if 'vision_items' in entry:
+            result = {
+                'filename': entry['filename'],
                 'success': True,
-                'items': gemini_result['items'],
-                'full_description': gemini_result.get('full_description', ''),
-                'count': len(gemini_result['items']),
-                'source': 'gemini',
-                'debug': debug_info
-            })
+                'items': entry['vision_items'],
+                'count': len(entry['vision_items']),
+                'source': 'vision_api'
+            }
         else:
-            app.logger.info(f"===== Returning Vision API results =====")
-            app.logger.info(f"Items count: {len(vision_items)}")
-            app.logger.warning(f"Using Vision API - condition_result={debug_info['condition_result']}")
-            return jsonify({
-                'success': True,
-                'items': vision_items,
-                'count': len(vision_items),
-                'source': 'vision_api',
-                'debug': debug_info  # Include debug info so we can see it in browser
-            })
+            result = {'filename': entry['filename'], 'error': entry['vision_error']}
+        if 'gemini_error' in entry:
+            result['gemini_error'] = entry['gemini_error']
+        results[entry['index']] = result
     
-    except Exception as e:
-        # Clean up file if it exists
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
-        if os.path.exists(filepath):
-            os.remove(filepath)
-        
-        return jsonify({'error': str(e)}), 500
+    history = history_context(request.headers, request.form)
+    for entry in entries:
+        record_meal(history, results[entry['index']], entry['filename'])
+    
+    response = {
+        'success': True,
+        'results': results,
+        'count': len(results),
+        'succeeded': sum(1 for result in results if result.get('success'))
+    }
+    if app.config['VERBOSE_LOGGING']:
+        for entry in entries:
+            results[entry['index']]['debug'] = {
+                'cache': entry['cache'],
+                'normalization': entry['upload'].variant_stats
+            }
+        response['cache'] = result_cache.snapshot()
+    
+    debug_log(f"[BATCH] Completed batch of {len(files)} files")
+    return jsonify(response)
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue an image for background analysis and return its job id immediately"""
+    error = upload_file_error(request.files)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    file = request.files['file']
+    callback_url = request.form.get('callback_url')
+    if callback_url and not app.config['JOB_CALLBACKS_ENABLED']:
+        return jsonify({'error': 'Job callbacks are disabled on this server'}), 400
+    if callback_url and not callback_url.startswith(('http://', 'https://')):
+        return jsonify({'error': 'callback_url must be an http(s) URL'}), 400
+    
+    upload = read_upload(file)
+    
+    use_gemini = request.form.get('use_gemini', 'true').lower() == 'true'
+    try:
+        job_id = job_store.submit(run_analysis_job, upload, use_gemini, filename=file.filename,
+                                  callback_url=callback_url, history=history_context(request.headers, request.form))
+    except JobQueueFull:
+        JOB_REJECTIONS.inc()
+        debug_log(f"[JOBS] Queue full, refused job for {file.filename}")
+        return jsonify({'error': 'Too many jobs are waiting; try again shortly'}), 503, {'Retry-After': '5'}
+    debug_log(f"[JOBS] Queued job {job_id} for {file.filename}")
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/jobs/{job_id}'
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Poll a background job for its status and, once finished, its result"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    
+    response = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'filename': job.get('filename'),
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at']
+    }
+    if job['status'] == 'done':
+        response['result'] = job['result']
+    elif job['status'] == 'error':
+        response['error'] = job['error']
+    return jsonify(response)
+
+startup_timings['module_load'] = round((time.perf_counter() - STARTUP_STARTED) * 1000, 1)
+print(f"[STARTUP] app.py loaded in {startup_timings['module_load']}ms (imports {startup_timings['imports']}ms)")
+if app.config['WARM_UP']:
+    threading.Thread(target=warm_up, name='snaptrack-warm-up', daemon=True).start()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
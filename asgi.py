@@ -0,0 +1,163 @@
+"""ASGI entry point for production serving:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+POST /upload is handled on the event loop with the async Vision and Gemini
+clients, so one process can keep hundreds of analyses in flight without a
+thread each. The multipart body is parsed as it arrives, so an upload that
+fails screening is refused before the rest of it is received. Only the
+CPU-bound steps (normalization, hashing) borrow a thread. Every other route is served by the Flask app on a
+pool of ASGI_WSGI_WORKERS threads.
+"""
+import json
+import time
+import asyncio
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import FileStorage, Headers, MultiDict
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+import app as snaptrack
+from metrics import timed, REQUEST_SECONDS, REQUESTS, IN_FLIGHT, UPLOAD_REJECTIONS
+from upload_guard import UploadRejected
+
+flask_app = WSGIMiddleware(snaptrack.app, workers=snaptrack.app.config['ASGI_WSGI_WORKERS'])
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+async def receive_form(receive, content_type, limit):
+    """(form, files) for a multipart body, parsed chunk by chunk as it is received.
+
+    File parts are written to snaptrack.upload_buffer() containers, so a file that
+    fails screening raises UploadRejected without waiting for the rest of the body.
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get('boundary', '').encode('ascii')
+    if mimetype != 'multipart/form-data' or not boundary:
+        return MultiDict(), MultiDict()
+
+    form, files = MultiDict(), MultiDict()
+    decoder = MultipartDecoder(boundary)
+    part = container = None
+    size = 0
+    more_body = True
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            if not more_body:
+                raise ValueError('Incomplete multipart body')
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if limit and size > limit:
+                raise RequestTooLarge()
+            more_body = message.get('more_body', False)
+            decoder.receive_data(chunk)
+            if not more_body:
+                decoder.receive_data(None)
+        elif isinstance(event, Field):
+            part, container = event, []
+        elif isinstance(event, File):
+            part, container = event, snaptrack.upload_buffer(event.filename)
+        elif isinstance(event, Data):
+            if isinstance(part, File):
+                container.write(event.data)
+            else:
+                container.append(event.data)
+            if not event.more_data:
+                if isinstance(part, File):
+                    container.seek(0)
+                    files.add(part.name, FileStorage(container, part.filename, part.name, headers=Headers(part.headers)))
+                else:
+                    form.add(part.name, b''.join(container).decode('utf-8', 'replace'))
+        elif isinstance(event, Epilogue):
+            return form, files
+
+
+async def handle_upload(scope, receive):
+    """Async /upload; returns (status, payload)"""
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    limit = snaptrack.app.config['MAX_CONTENT_LENGTH']
+    if limit and int(headers.get('content-length') or 0) > limit:
+        UPLOAD_REJECTIONS.inc(reason='body_too_large')
+        return 413, {'error': 'File too large', 'reason': 'body_too_large'}
+
+    try:
+        with timed('receive'):
+            form, files = await receive_form(receive, headers.get('content-type', ''), limit)
+        error = snaptrack.upload_file_error(files)
+        if error:
+            snaptrack.debug_log(f"[UPLOAD] ERROR: {error}")
+            return 400, {'error': error}
+        upload = await asyncio.to_thread(snaptrack.read_upload, files['file'])
+    except RequestTooLarge:
+        UPLOAD_REJECTIONS.inc(reason='body_too_large')
+        return 413, {'error': 'File too large', 'reason': 'body_too_large'}
+    except UploadRejected as e:
+        return e.status, snaptrack.rejection_payload(e)
+    except ValueError as e:
+        return 400, {'error': f'Malformed upload: {e}'}
+
+    try:
+        use_gemini = form.get('use_gemini', 'true').lower() == 'true'
+        result = await snaptrack.analyze_image_async(upload, use_gemini)
+        snaptrack.record_meal(snaptrack.history_context(headers, form), result, files['file'].filename)
+        return 200, result
+    except Exception as e:
+        return 500, {'error': str(e)}
+
+
+async def upload(scope, receive, send):
+    # Same metrics as the Flask request hooks record for upload_file
+    started = time.perf_counter()
+    IN_FLIGHT.inc(endpoint='upload_file')
+    status = 500
+    try:
+        status, payload = await handle_upload(scope, receive)
+        body = json.dumps(payload).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+    except ClientDisconnected:
+        status = 499
+    finally:
+        IN_FLIGHT.dec(endpoint='upload_file')
+        REQUESTS.inc(endpoint='upload_file', status=status)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint='upload_file')
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            if snaptrack.app.config['WARM_UP']:
+                # The async client belongs to this event loop, so it can't be built by warm_up()
+                try:
+                    snaptrack.get_vision_async_client()
+                except Exception as e:
+                    print(f"[WARNING] Vision async client warm-up failed: {e}")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/upload':
+        await upload(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
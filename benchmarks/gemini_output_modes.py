@@ -0,0 +1,141 @@
+"""Compare Gemini 'detailed' and 'compact' output modes over recorded responses.
+
+Reports output size (tokens), provider latency when it was recorded, and
+parse time for each mode:
+
+    python benchmarks/gemini_output_modes.py [responses.json]
+
+The bundled default, synthetic_gemini_responses.json, is SYNTHETIC: hand-written
+responses with no latencies, so its token counts are estimated from text length
+and the report is only an illustration. Record real responses (needs
+GEMINI_API_KEY) for actual token and latency savings:
+
+    python benchmarks/gemini_output_modes.py --record out.json photo1.jpg photo2.jpg
+    python benchmarks/gemini_output_modes.py out.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as snaptrack
+from image_buffer import UploadedImage
+
+DEFAULT_RESPONSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synthetic_gemini_responses.json')
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) when no real count was recorded"""
+    return max(1, round(len(text) / 4))
+
+
+def parse(mode, text):
+    if mode == 'compact':
+        try:
+            return snaptrack.parse_gemini_compact(text)[0]
+        except ValueError:
+            pass
+    return snaptrack.parse_gemini_response(text)
+
+
+def time_parse(mode, text, repeat=2000):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parse(mode, text)
+    return (time.perf_counter() - started) / repeat * 1e6  # microseconds
+
+
+def record(output_path, image_paths):
+    """Run each image through both modes against the live API and save the responses"""
+    if not snaptrack.GEMINI_API_KEY:
+        sys.exit('GEMINI_API_KEY must be set to record responses')
+    
+    model = snaptrack.get_gemini_model()
+    records = []
+    for path in image_paths:
+        with open(path, 'rb') as f:
+            upload = UploadedImage(f.read(), os.path.basename(path))
+        for mode in ('detailed', 'compact'):
+            if mode == 'compact':
+                prompt = snaptrack.gemini_compact_prompt(snaptrack.app.config['GEMINI_COMPACT_DESCRIPTION'])
+                config = {'max_output_tokens': snaptrack.app.config['GEMINI_MAX_OUTPUT_TOKENS'], 'temperature': 0}
+            else:
+                prompt, config = snaptrack.GEMINI_PROMPT, None
+            started = time.perf_counter()
+            response = model.generate_content([prompt, upload.gemini_part()], generation_config=config)
+            latency_ms = (time.perf_counter() - started) * 1000
+            text = response.text
+            records.append({
+                'image': upload.filename,
+                'mode': mode,
+                'text': text,
+                'latency_ms': round(latency_ms, 1),
+                'output_tokens': model.count_tokens(text).total_tokens,
+            })
+            print(f"{upload.filename} [{mode}] {latency_ms:.0f}ms")
+    
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, indent=2)
+    print(f"Saved {len(records)} responses to {output_path}")
+
+
+def report(responses_path):
+    with open(responses_path, encoding='utf-8') as f:
+        records = json.load(f)
+    
+    synthetic = sum(1 for record in records if record.get('synthetic'))
+    if synthetic:
+        print(f"NOTE: {synthetic} of {len(records)} responses are SYNTHETIC (hand-written, not captured from "
+              f"Gemini).\nThe numbers below illustrate the report only; record real responses with --record.\n")
+    
+    summary = {}
+    estimated = False
+    for record in records:
+        stats = summary.setdefault(record['mode'], {'tokens': [], 'latency': [], 'parse_us': []})
+        if not record.get('output_tokens'):
+            estimated = True
+        stats['tokens'].append(record.get('output_tokens') or estimate_tokens(record['text']))
+        if record.get('latency_ms') is not None:
+            stats['latency'].append(record['latency_ms'])
+        stats['parse_us'].append(time_parse(record['mode'], record['text']))
+    
+    print(f"{'mode':<10} {'n':>3} {'out tokens':>11} {'latency ms':>11} {'parse us':>9}")
+    for mode, stats in sorted(summary.items()):
+        latency = f"{statistics.mean(stats['latency']):.0f}" if stats['latency'] else 'n/a'
+        print(f"{mode:<10} {len(stats['tokens']):>3} {statistics.mean(stats['tokens']):>11.1f} "
+              f"{latency:>11} {statistics.mean(stats['parse_us']):>9.1f}")
+    
+    if 'detailed' in summary and 'compact' in summary:
+        detailed, compact = summary['detailed'], summary['compact']
+        token_saving = 1 - statistics.mean(compact['tokens']) / statistics.mean(detailed['tokens'])
+        source = 'synthetic responses' if synthetic else 'recorded responses'
+        counted = ', tokens estimated from text length' if estimated else ''
+        print(f"\ncompact uses {token_saving:.0%} fewer output tokens than detailed ({source}{counted})")
+        if detailed['latency'] and compact['latency']:
+            latency_saving = 1 - statistics.mean(compact['latency']) / statistics.mean(detailed['latency'])
+            print(f"compact is {latency_saving:.0%} faster end to end")
+        else:
+            print("no latencies recorded; use --record against the live API to measure them")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('responses', nargs='?', default=DEFAULT_RESPONSES, help='recorded responses JSON')
+    parser.add_argument('--record', nargs='+', metavar='PATH',
+                        help='OUTPUT IMAGE [IMAGE ...]: record live responses for the images into OUTPUT')
+    args = parser.parse_args()
+    
+    if args.record:
+        if len(args.record) < 2:
+            parser.error('--record needs an output path and at least one image')
+        record(args.record[0], args.record[1:])
+    else:
+        report(args.responses)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Drive /upload at a fixed concurrency and report throughput and latency percentiles.
+
+By default the Flask app runs in-process with the fake providers from fakes.py,
+so no credentials or network are needed:
+
+    python benchmarks/load_test.py --requests 500 --concurrency 16
+    python benchmarks/load_test.py --gemini-latency lognormal:2500,0.4 --gemini-error-rate 0.1
+
+Point it at a running server instead (start that with SNAPTRACK_FAKE_PROVIDERS=true
+to measure the server without the providers):
+
+    python benchmarks/load_test.py --url http://localhost:5000 --concurrency 32
+"""
+import io
+import os
+import sys
+import json
+import math
+import contextlib
+import time
+import uuid
+import random
+import argparse
+import statistics
+import urllib.request
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_image(width, height, seed):
+    """A JPEG of random shapes; different seeds give different perceptual hashes,
+    so the result cache doesn't answer for the providers"""
+    import PIL.Image
+    import PIL.ImageDraw
+    rng = random.Random(seed)
+    image = PIL.Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    draw = PIL.ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(width // 8, width // 2), rng.randrange(height // 8, height // 2)
+        draw.ellipse((x, y, x + w, y + h), fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def load_images(args):
+    if args.image:
+        images = []
+        for path in args.image:
+            with open(path, 'rb') as f:
+                images.append((os.path.basename(path), f.read()))
+        return images
+    width, height = args.size
+    return [(f'load-{i}.jpg', make_image(width, height, seed=i)) for i in range(args.distinct)]
+
+
+def in_process_sender(args):
+    """Post through the Flask test client, with the fake providers configured from args"""
+    os.environ.setdefault('SNAPTRACK_FAKE_PROVIDERS', 'true')
+    for option, env in (('vision_latency', 'SNAPTRACK_FAKE_VISION_LATENCY'),
+                        ('vision_error_rate', 'SNAPTRACK_FAKE_VISION_ERROR_RATE'),
+                        ('gemini_latency', 'SNAPTRACK_FAKE_GEMINI_LATENCY'),
+                        ('gemini_error_rate', 'SNAPTRACK_FAKE_GEMINI_ERROR_RATE'),
+                        ('gemini_responses', 'SNAPTRACK_FAKE_GEMINI_RESPONSES'),
+                        ('mode', 'SNAPTRACK_ANALYSIS_MODE')):
+        if getattr(args, option) is not None:
+            os.environ[env] = str(getattr(args, option))
+    if not args.cache:
+        os.environ['SNAPTRACK_CACHE_SIZE'] = '0'
+        os.environ.pop('SNAPTRACK_CACHE_DIR', None)
+    # Meal history is still written (off the request path), just not into the working directory
+    os.environ.setdefault('SNAPTRACK_HISTORY_DB', os.path.join(tempfile.gettempdir(), 'snaptrack_load_test_history.db'))
+    os.environ.setdefault('SNAPTRACK_HISTORY_USER_HEADER', 'X-Load-Test-User')
+
+    # Keep the app's startup prints out of the report (and out of --json output)
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as snaptrack
+
+    def send(filename, data):
+        client = snaptrack.app.test_client()
+        response = client.post('/upload', data={
+            'file': (io.BytesIO(data), filename),
+            'use_gemini': 'true' if args.use_gemini else 'false',
+        }, content_type='multipart/form-data', headers={os.environ['SNAPTRACK_HISTORY_USER_HEADER']: 'load-test'})
+        return response.status_code, response.get_json(silent=True) or {}
+    return send
+
+
+def http_sender(args):
+    """Post multipart requests to a running server"""
+    url = args.url.rstrip('/') + '/upload'
+
+    def send(filename, data):
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="use_gemini"\r\n\r\n'
+            f'{"true" if args.use_gemini else "false"}\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'
+        ).encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        request = urllib.request.Request(url, data=body, headers={
+            'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        try:
+            with urllib.request.urlopen(request, timeout=120) as response:
+                return response.status, json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as e:
+            return e.code, {}
+    return send
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return float('nan')
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run(args):
+    images = load_images(args)
+    send = http_sender(args) if args.url else in_process_sender(args)
+
+    def one(index):
+        filename, data = images[index % len(images)]
+        started = time.perf_counter()
+        try:
+            status, payload = send(filename, data)
+        except Exception as e:
+            status, payload = 'exception', {'error': str(e)}
+        return time.perf_counter() - started, status, payload.get('source', 'error')
+
+    # Warm up outside the measurement (imports, first client creation)
+    for index in range(min(args.warmup, args.requests)):
+        one(index)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        samples = list(executor.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _, _ in samples)
+    statuses, sources = {}, {}
+    for _, status, source in samples:
+        statuses[status] = statuses.get(status, 0) + 1
+        sources[source] = sources.get(source, 0) + 1
+    ok = statuses.get(200, 0)
+
+    report = {
+        'requests': len(samples),
+        'concurrency': args.concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 2),
+        'error_rate': round(1 - ok / len(samples), 4),
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies), 1),
+            'p50': round(percentile(latencies, 0.50), 1),
+            'p95': round(percentile(latencies, 0.95), 1),
+            'p99': round(percentile(latencies, 0.99), 1),
+            'max': round(latencies[-1], 1),
+        },
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'sources': sources,
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='total requests (default 200)')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at once (default 8)')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests sent first (default 2)')
+    parser.add_argument('--url', help='base URL of a running server; default runs the app in-process')
+    parser.add_argument('--image', action='append', help='image file to send (repeatable); default synthesizes JPEGs')
+    parser.add_argument('--distinct', type=int, default=50, help='number of synthesized images (default 50)')
+    parser.add_argument('--size', type=int, nargs=2, default=(1600, 1200), metavar=('W', 'H'),
+                        help='synthesized image size (default 1600 1200)')
+    parser.add_argument('--no-gemini', dest='use_gemini', action='store_false', help='send use_gemini=false')
+    parser.add_argument('--cache', action='store_true', help='keep the in-process result cache enabled')
+    parser.add_argument('--mode', choices=('serial', 'hedged', 'parallel'), help='in-process ANALYSIS_MODE')
+    parser.add_argument('--vision-latency', help="fake Vision latency spec, e.g. 'lognormal:700,0.35'")
+    parser.add_argument('--vision-error-rate', type=float, help='fake Vision failure probability')
+    parser.add_argument('--gemini-latency', help="fake Gemini latency spec, e.g. 'fixed:2000'")
+    parser.add_argument('--gemini-error-rate', type=float, help='fake Gemini failure probability')
+    parser.add_argument('--gemini-responses', help='recorded Gemini responses JSON for the fake to replay')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    latency = report['latency_ms']
+    print(f"{report['requests']} requests at concurrency {report['concurrency']} in {report['elapsed_s']}s")
+    print(f"throughput: {report['throughput_rps']} req/s, error rate: {report['error_rate']:.2%}")
+    print(f"latency ms: mean {latency['mean']}  p50 {latency['p50']}  p95 {latency['p95']}  "
+          f"p99 {latency['p99']}  max {latency['max']}")
+    print(f"statuses: {report['statuses']}  sources: {report['sources']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Micro-benchmarks for the Gemini response parsers and the Vision merge/dedupe.
+
+    python benchmarks/micro_parsers.py
+    python benchmarks/micro_parsers.py --save baseline.json
+    python benchmarks/micro_parsers.py --compare baseline.json --tolerance 1.3
+
+With --compare the exit status is 1 if any case got slower than its baseline
+by more than the tolerance factor, so it can gate a deploy.
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes
+import app as snaptrack
+
+# Hand-written responses: fine for parser timings, which only depend on the text's shape
+SAMPLE_RESPONSES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'synthetic_gemini_responses.json')
+
+
+def vision_response(entities):
+    """Fake annotate response with the given number of web entities, objects and labels.
+    Half the descriptions repeat across annotation types to exercise the dedupe."""
+    names = [f'Food item {i}' for i in range(entities)]
+    return SimpleNamespace(
+        web_detection=SimpleNamespace(
+            best_guess_labels=[SimpleNamespace(label=names[0])],
+            web_entities=[SimpleNamespace(description=name, score=0.9 - i * 0.3 / entities)
+                          for i, name in enumerate(names)],
+        ),
+        localized_object_annotations=[SimpleNamespace(name=name.upper(), score=0.8)
+                                      for name in names[::2]],
+        label_annotations=[SimpleNamespace(description=name.lower() if i % 2 else f'Label {i}', score=0.7)
+                           for i, name in enumerate(names)],
+    )
+
+
+def cases():
+    with open(SAMPLE_RESPONSES, encoding='utf-8') as f:
+        records = json.load(f)
+    detailed = [r['text'] for r in records if r['mode'] == 'detailed']
+    compact = [r['text'] for r in records if r['mode'] == 'compact']
+    unstructured = ("This plate holds grilled salmon topped with lemon butter and served with "
+                    "roasted asparagus and wild rice. A small side salad with cherry tomatoes sits nearby. ") * 3
+
+    def each(fn, texts):
+        return lambda: [fn(text) for text in texts]
+
+    canned = fakes.FakeImageAnnotatorClient._response()
+    small, large = vision_response(10), vision_response(50)
+    return {
+        'gemini_parse_detailed': (each(snaptrack.parse_gemini_response, detailed), len(detailed)),
+        'gemini_parse_unstructured': (each(snaptrack.parse_gemini_response, [unstructured]), 1),
+        'gemini_parse_compact': (each(snaptrack.parse_gemini_compact, compact), len(compact)),
+        'vision_merge_canned': (lambda: snaptrack.merge_vision_annotations(
+            canned.web_detection, canned.localized_object_annotations, canned.label_annotations), 1),
+        'vision_merge_10': (lambda: snaptrack.merge_vision_annotations(
+            small.web_detection, small.localized_object_annotations, small.label_annotations), 1),
+        'vision_merge_50': (lambda: snaptrack.merge_vision_annotations(
+            large.web_detection, large.localized_object_annotations, large.label_annotations), 1),
+    }
+
+
+def measure(fn, per_call, repeat=5):
+    """Best-of-repeat time per parsed response, in microseconds"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()  # enough calls for ~0.2s per repeat
+    return min(timer.repeat(repeat=repeat, number=number)) / number / per_call * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--save', metavar='PATH', help='write the results as a baseline JSON file')
+    parser.add_argument('--compare', metavar='PATH', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown factor allowed before --compare fails (default 1.25)')
+    args = parser.parse_args()
+
+    results = {name: measure(fn, per_call) for name, (fn, per_call) in cases().items()}
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'case':<28} {'us/op':>9} {'baseline':>9} {'ratio':>6}")
+    for name, value in results.items():
+        if name in baseline:
+            ratio = value / baseline[name]
+            flag = '  SLOWER' if ratio > args.tolerance else ''
+            print(f"{name:<28} {value:>9.2f} {baseline[name]:>9.2f} {ratio:>6.2f}{flag}")
+            if ratio > args.tolerance:
+                regressions.append(name)
+        else:
+            print(f"{name:<28} {value:>9.2f} {'-':>9} {'-':>6}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({name: round(value, 3) for name, value in results.items()}, f, indent=2)
+        print(f"Saved baseline to {args.save}")
+
+    if regressions:
+        sys.exit(f"Regressed beyond {args.tolerance}x: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Local stand-ins for the Vision and Gemini clients, for load tests and offline runs.
+
+Enabled with SNAPTRACK_FAKE_PROVIDERS=true. Each fake sleeps for a latency
+drawn from a configurable distribution, fails at a configurable rate and
+returns canned responses shaped like the real client objects.
+"""
+import json
+import time
+import random
+import asyncio
+from types import SimpleNamespace
+
+CANNED_GEMINI_DETAILED = [
+    "MAIN ITEM: Hamburger with a grilled beef patty, melted cheddar cheese, fresh iceberg lettuce, "
+    "sliced red tomato, and dill pickles on a toasted sesame seed bun\n\n"
+    "ADDITIONAL ITEMS: French fries\n\n"
+    "DETAILED DESCRIPTION: A hamburger with a thick grilled patty topped with melted cheddar, lettuce, "
+    "tomato and pickles on a sesame seed bun. A serving of golden French fries sits beside it.",
+    "MAIN ITEM: Caesar salad with chopped romaine lettuce, shaved parmesan cheese, garlic croutons, "
+    "and creamy Caesar dressing\n\n"
+    "ADDITIONAL ITEMS: Grilled chicken breast slices\nLemon wedge\n\n"
+    "DETAILED DESCRIPTION: A bowl of Caesar salad topped with parmesan, croutons and sliced grilled "
+    "chicken. A lemon wedge rests on the rim of the bowl.",
+]
+
+CANNED_GEMINI_COMPACT = [
+    '{"items": [{"name": "Hamburger with grilled beef patty, cheddar, lettuce, tomato and pickles on a sesame bun", '
+    '"confidence": 0.95}, {"name": "French fries", "confidence": 0.9}]}',
+    '{"items": [{"name": "Caesar salad with romaine, parmesan, croutons and Caesar dressing", "confidence": 0.94}, '
+    '{"name": "Grilled chicken breast slices", "confidence": 0.88}]}',
+]
+
+CANNED_VISION = {
+    'best_guess_labels': ['cheeseburger'],
+    'web_entities': [('Hamburger', 0.92), ('Cheeseburger', 0.85), ('French fries', 0.71), ('Fast food', 0.55)],
+    'objects': [('Food', 0.88), ('Tableware', 0.61)],
+    'labels': [('Food', 0.97), ('Bun', 0.93), ('Burger', 0.9), ('Fast food', 0.86), ('Patty', 0.78)],
+}
+
+
+class LatencyModel:
+    """Latency distribution parsed from a spec string, in milliseconds.
+
+    'fixed:800', 'uniform:200,1200' or 'lognormal:800,0.5' (median ms, sigma).
+    """
+
+    def __init__(self, spec):
+        kind, _, params = spec.partition(':')
+        values = [float(v) for v in params.split(',') if v]
+        if kind == 'fixed' and len(values) == 1:
+            self._sample = lambda: values[0]
+        elif kind == 'uniform' and len(values) == 2:
+            self._sample = lambda: random.uniform(values[0], values[1])
+        elif kind == 'lognormal' and len(values) == 2:
+            import math
+            mu = math.log(values[0])
+            self._sample = lambda: random.lognormvariate(mu, values[1])
+        else:
+            raise ValueError(f"Invalid latency spec: {spec!r}")
+        self.spec = spec
+
+    def seconds(self, fraction=1.0):
+        return max(0.0, self._sample()) * fraction / 1000
+
+    def sleep(self, fraction=1.0):
+        time.sleep(self.seconds(fraction))
+
+    async def sleep_async(self, fraction=1.0):
+        await asyncio.sleep(self.seconds(fraction))
+
+
+class FakeProviderError(Exception):
+    """Injected failure from a fake provider"""
+
+
+class FakeImageAnnotatorClient:
+    """Stand-in for vision.ImageAnnotatorClient"""
+
+    latency = LatencyModel('lognormal:700,0.35')
+    error_rate = 0.0
+
+    @classmethod
+    def configure(cls, latency=None, error_rate=None):
+        if latency:
+            cls.latency = LatencyModel(latency)
+        if error_rate is not None:
+            cls.error_rate = float(error_rate)
+
+    def _call(self):
+        self.latency.sleep()
+        if random.random() < self.error_rate:
+            raise FakeProviderError('Fake Vision API error (injected)')
+
+    @staticmethod
+    def _response():
+        return SimpleNamespace(
+            web_detection=SimpleNamespace(
+                best_guess_labels=[SimpleNamespace(label=label) for label in CANNED_VISION['best_guess_labels']],
+                web_entities=[SimpleNamespace(description=d, score=s) for d, s in CANNED_VISION['web_entities']],
+            ),
+            localized_object_annotations=[SimpleNamespace(name=n, score=s) for n, s in CANNED_VISION['objects']],
+            label_annotations=[SimpleNamespace(description=d, score=s) for d, s in CANNED_VISION['labels']],
+            error=SimpleNamespace(message=''),
+        )
+
+    def annotate_image(self, request, **kwargs):
+        self._call()
+        return self._response()
+
+    def batch_annotate_images(self, requests, **kwargs):
+        # One round trip for the whole batch
+        self._call()
+        return SimpleNamespace(responses=[self._response() for _ in requests])
+
+    def web_detection(self, image, **kwargs):
+        return self.annotate_image({'image': image})
+
+    def object_localization(self, image, **kwargs):
+        return self.annotate_image({'image': image})
+
+    def label_detection(self, image, **kwargs):
+        return self.annotate_image({'image': image})
+
+
+class FakeImageAnnotatorAsyncClient(FakeImageAnnotatorClient):
+    """Stand-in for vision.ImageAnnotatorAsyncClient; waits without blocking the event loop"""
+
+    async def batch_annotate_images(self, requests, **kwargs):
+        await self.latency.sleep_async()
+        if random.random() < self.error_rate:
+            raise FakeProviderError('Fake Vision API error (injected)')
+        return SimpleNamespace(responses=[self._response() for _ in requests])
+
+
+class FakeGenerativeModel:
+    """Stand-in for genai.GenerativeModel"""
+
+    latency = LatencyModel('lognormal:2500,0.4')
+    error_rate = 0.0
+    responses = {'detailed': CANNED_GEMINI_DETAILED, 'compact': CANNED_GEMINI_COMPACT}
+
+    @classmethod
+    def configure(cls, latency=None, error_rate=None, responses=None):
+        """responses is a JSON file of {"mode": ..., "text": ...} records, such as
+        one written by benchmarks/gemini_output_modes.py --record"""
+        if latency:
+            cls.latency = LatencyModel(latency)
+        if error_rate is not None:
+            cls.error_rate = float(error_rate)
+        if responses:
+            with open(responses, encoding='utf-8') as f:
+                records = json.load(f)
+            canned = {}
+            for record in records:
+                canned.setdefault(record['mode'], []).append(record['text'])
+            cls.responses = {mode: canned.get(mode) or cls.responses[mode] for mode in ('detailed', 'compact')}
+
+    def __init__(self, model_name='fake-gemini', **kwargs):
+        self.model_name = model_name
+
+    def _response_text(self, generation_config):
+        # Compact mode is the only caller that caps output tokens
+        mode = 'compact' if generation_config and generation_config.get('max_output_tokens') else 'detailed'
+        return random.choice(self.responses[mode])
+
+    @staticmethod
+    def _timeout(request_options):
+        return (request_options or {}).get('timeout')
+
+    def generate_content(self, contents, generation_config=None, stream=False, request_options=None, **kwargs):
+        if random.random() < self.error_rate:
+            self.latency.sleep(0.5)
+            raise FakeProviderError('Fake Gemini API error (injected)')
+
+        text = self._response_text(generation_config)
+
+        if not stream:
+            latency, timeout = self.latency.seconds(), self._timeout(request_options)
+            if timeout is not None and latency > timeout:
+                time.sleep(timeout)
+                raise FakeProviderError('Fake Gemini deadline exceeded')
+            time.sleep(latency)
+            return SimpleNamespace(text=text)
+
+        def chunks(size=40):
+            # Spread the latency over the chunks like a real token stream
+            pieces = [text[i:i + size] for i in range(0, len(text), size)]
+            for piece in pieces:
+                self.latency.sleep(1.0 / len(pieces))
+                yield SimpleNamespace(text=piece)
+        return chunks()
+
+    async def generate_content_async(self, contents, generation_config=None, request_options=None, **kwargs):
+        if random.random() < self.error_rate:
+            await self.latency.sleep_async(0.5)
+            raise FakeProviderError('Fake Gemini API error (injected)')
+        latency, timeout = self.latency.seconds(), self._timeout(request_options)
+        if timeout is not None and latency > timeout:
+            await asyncio.sleep(timeout)
+            raise FakeProviderError('Fake Gemini deadline exceeded')
+        await asyncio.sleep(latency)
+        return SimpleNamespace(text=self._response_text(generation_config))
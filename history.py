@@ -0,0 +1,233 @@
+import json
+import time
+import queue
+import sqlite3
+import threading
+from collections import Counter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    source TEXT,
+    filename TEXT,
+    item_count INTEGER NOT NULL,
+    items TEXT NOT NULL,
+    full_description TEXT
+);
+CREATE INDEX IF NOT EXISTS meals_by_user ON meals (user_id, recorded_at, id);
+CREATE INDEX IF NOT EXISTS meals_by_user_day ON meals (user_id, day, recorded_at, id);
+
+CREATE TABLE IF NOT EXISTS daily_summaries (
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    meal_count INTEGER NOT NULL,
+    item_count INTEGER NOT NULL,
+    items TEXT NOT NULL,
+    first_at REAL NOT NULL,
+    last_at REAL NOT NULL,
+    PRIMARY KEY (user_id, day)
+) WITHOUT ROWID;
+"""
+
+
+def local_day(timestamp, utc_offset_minutes=0):
+    """YYYY-MM-DD of a timestamp in the user's time zone"""
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp + utc_offset_minutes * 60))
+
+
+def encode_cursor(recorded_at, meal_id):
+    return f'{recorded_at!r}:{meal_id}'
+
+
+def decode_cursor(cursor):
+    """(recorded_at, id) from a cursor returned by meals(); raises ValueError if malformed"""
+    recorded_at, meal_id = cursor.split(':')
+    return float(recorded_at), int(meal_id)
+
+
+class MealHistory:
+    """Per-user meal log in SQLite, with daily summaries kept up to date as meals are added.
+
+    record() only queues the meal; a background thread writes queued meals in
+    batches of up to batch_size, each batch (and its summary updates) in one
+    transaction. A meal shows up in queries within about flush_interval
+    seconds. If more than max_queue meals are waiting, new ones are dropped.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0, max_queue=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._local = threading.local()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self.stats = {'recorded': 0, 'written': 0, 'batches': 0, 'dropped': 0, 'write_errors': 0}
+
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        db.row_factory = sqlite3.Row
+        # WAL lets queries run while a batch is being written
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def _reader(self):
+        # One connection per request thread
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    # ----- writes -----
+
+    def record(self, user_id, result, filename=None, utc_offset_minutes=0, recorded_at=None):
+        """Queue an analysis result for user_id. Never blocks; returns False if it was dropped."""
+        recorded_at = time.time() if recorded_at is None else recorded_at
+        meal = (user_id, recorded_at, local_day(recorded_at, utc_offset_minutes), result.get('source'),
+                filename, result.get('items') or [], result.get('full_description'))
+        self._start_writer()
+        try:
+            self._queue.put_nowait(meal)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['recorded'] += 1
+        return True
+
+    def _start_writer(self):
+        # Started on first use so importing the app doesn't start threads
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name='snaptrack-history', daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            meals = [self._queue.get()]
+            # Let a batch build up, but never hold a meal longer than flush_interval
+            deadline = time.monotonic() + self.flush_interval
+            while len(meals) < self.batch_size:
+                try:
+                    meals.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(db, meals)
+            except Exception as e:
+                self.stats['write_errors'] += 1
+                print(f"[HISTORY] Failed to write {len(meals)} meals: {e}")
+            finally:
+                for _ in meals:
+                    self._queue.task_done()
+
+    def _write_batch(self, db, meals):
+        rows = [(user_id, recorded_at, day, source, filename, len(items), json.dumps(items), description)
+                for user_id, recorded_at, day, source, filename, items, description in meals]
+
+        # Roll the batch up per (user, day) first so each summary row is touched once
+        rollups = {}
+        for user_id, recorded_at, day, _, _, items, _ in meals:
+            rollup = rollups.setdefault((user_id, day), {
+                'meal_count': 0, 'items': Counter(), 'first_at': recorded_at, 'last_at': recorded_at})
+            rollup['meal_count'] += 1
+            rollup['items'].update(item['description'].strip().lower() for item in items if item.get('description'))
+            rollup['first_at'] = min(rollup['first_at'], recorded_at)
+            rollup['last_at'] = max(rollup['last_at'], recorded_at)
+
+        with db:
+            db.executemany(
+                'INSERT INTO meals (user_id, recorded_at, day, source, filename, item_count, items, full_description) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            for (user_id, day), rollup in rollups.items():
+                existing = db.execute('SELECT meal_count, items, first_at, last_at FROM daily_summaries '
+                                      'WHERE user_id = ? AND day = ?', (user_id, day)).fetchone()
+                if existing:
+                    rollup['meal_count'] += existing['meal_count']
+                    rollup['items'].update(json.loads(existing['items']))
+                    rollup['first_at'] = min(rollup['first_at'], existing['first_at'])
+                    rollup['last_at'] = max(rollup['last_at'], existing['last_at'])
+                db.execute(
+                    'INSERT OR REPLACE INTO daily_summaries '
+                    '(user_id, day, meal_count, item_count, items, first_at, last_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (user_id, day, rollup['meal_count'], sum(rollup['items'].values()),
+                     json.dumps(dict(rollup['items'].most_common())), rollup['first_at'], rollup['last_at']))
+        self.stats['written'] += len(meals)
+        self.stats['batches'] += 1
+
+    def flush(self):
+        """Block until every queued meal has been written"""
+        if self._writer is not None:
+            self._queue.join()
+
+    # ----- queries -----
+
+    def meals(self, user_id, limit=20, cursor=None, day=None):
+        """A page of user_id's meals, newest first, and the cursor for the next page (None at the end).
+
+        Pages are keyset-paginated on (recorded_at, id), so fetching any page
+        is one index range scan however far back it is.
+        """
+        sql = 'SELECT * FROM meals WHERE user_id = ?'
+        params = [user_id]
+        if day:
+            sql += ' AND day = ?'
+            params.append(day)
+        if cursor:
+            sql += ' AND (recorded_at, id) < (?, ?)'
+            params.extend(decode_cursor(cursor))
+        sql += ' ORDER BY recorded_at DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._reader().execute(sql, params).fetchall()
+        meals = [{
+            'id': row['id'],
+            'recorded_at': row['recorded_at'],
+            'day': row['day'],
+            'source': row['source'],
+            'filename': row['filename'],
+            'count': row['item_count'],
+            'items': json.loads(row['items']),
+            'full_description': row['full_description'],
+        } for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last['recorded_at'], last['id'])
+        return meals, next_cursor
+
+    def daily_summaries(self, user_id, limit=30, before=None):
+        """user_id's daily summaries, most recent day first, and the cursor for the next page.
+        before is a YYYY-MM-DD day (exclusive), as returned in the cursor."""
+        sql = 'SELECT * FROM daily_summaries WHERE user_id = ?'
+        params = [user_id]
+        if before:
+            sql += ' AND day < ?'
+            params.append(before)
+        sql += ' ORDER BY day DESC LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._reader().execute(sql, params).fetchall()
+        days = [{
+            'day': row['day'],
+            'meal_count': row['meal_count'],
+            'item_count': row['item_count'],
+            'items': json.loads(row['items']),
+            'first_at': row['first_at'],
+            'last_at': row['last_at'],
+        } for row in rows[:limit]]
+        next_cursor = rows[limit - 1]['day'] if len(rows) > limit else None
+        return days, next_cursor
+
+    def snapshot(self):
+        snapshot = dict(self.stats)
+        snapshot['queued'] = self._queue.qsize()
+        return snapshot
@@ -0,0 +1,105 @@
+import io
+import os
+import uuid
+import threading
+from werkzeug.utils import secure_filename
+
+from metrics import timed
+
+# MIME types Gemini accepts as raw inline data; anything else is decoded and re-encoded
+GEMINI_INLINE_MIME_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
+
+EXTENSION_MIME_TYPES = {
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+}
+
+
+def sniff_mime_type(data):
+    """MIME type from the file's magic bytes, or None if unrecognized"""
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class UploadedImage:
+    """An upload held in memory and passed by reference through the pipeline.
+
+    The raw bytes are read once from the request. PIL decoding happens lazily
+    and at most once, shared by every stage that needs pixels.
+    """
+
+    def __init__(self, data, filename, draft_dimension=None):
+        self.data = data
+        self.filename = filename
+        # Largest dimension any consumer needs; lets the JPEG decoder work at reduced scale
+        self.draft_dimension = draft_dimension
+        # Per-provider normalized copies and their stats (see preprocess.normalize_image)
+        self.variants = {}
+        self.variant_stats = {}
+        self.original_size = None
+        self._decoded = None
+        # Hedged calls may ask for pixels from two threads at once
+        self._decode_lock = threading.Lock()
+
+    @property
+    def mime_type(self):
+        sniffed = sniff_mime_type(self.data)
+        if sniffed:
+            return sniffed
+        extension = self.filename.rsplit('.', 1)[-1].lower() if '.' in self.filename else ''
+        return EXTENSION_MIME_TYPES.get(extension, 'application/octet-stream')
+
+    def decoded(self):
+        """The PIL image for these bytes, decoded on first use"""
+        with self._decode_lock:
+            if self._decoded is None:
+                with timed('decode'):
+                    return self._decode()
+            return self._decoded
+
+    def _decode(self):
+        if self._decoded is None:
+            import PIL.Image
+            image = PIL.Image.open(io.BytesIO(self.data))
+            self.original_size = image.size
+            if self.draft_dimension and max(image.size) > self.draft_dimension:
+                scale = self.draft_dimension / max(image.size)
+                image.draft(image.mode, (int(image.width * scale), int(image.height * scale)))
+            image.load()
+            self._decoded = image
+        return self._decoded
+
+    def gemini_part(self):
+        """Image part for generate_content: the raw bytes when Gemini accepts the
+        format as-is, otherwise the decoded image (which the client re-encodes)"""
+        if self.mime_type in GEMINI_INLINE_MIME_TYPES:
+            return {'mime_type': self.mime_type, 'data': self.data}
+        image = self.decoded()
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        return image
+
+    def spool(self, directory):
+        """Write a copy of the upload to directory for debugging; returns the path"""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{uuid.uuid4().hex}_{secure_filename(self.filename)}")
+        with io.open(path, 'wb') as f:
+            f.write(self.data)
+        return path
+
+    def __getstate__(self):
+        # Process-pool jobs pickle the upload; the decoded image is rebuilt on demand
+        return {'data': self.data, 'filename': self.filename, 'draft_dimension': self.draft_dimension}
+
+    def __setstate__(self, state):
+        self.__init__(state['data'], state['filename'], draft_dimension=state['draft_dimension'])
@@ -0,0 +1,114 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class JobQueueFull(Exception):
+    """submit() was refused: max_queued jobs are already waiting for a worker"""
+
+
+class JobStore:
+    """Background analysis jobs: submit returns an id immediately, results are polled.
+
+    Work runs on a thread or process pool. A queued job holds its whole upload
+    in memory, so once max_queued jobs are waiting beyond the busy workers,
+    submit() raises JobQueueFull (0 means no limit). Finished job records are
+    dropped once they are older than ttl seconds.
+    """
+
+    def __init__(self, workers=4, worker_type='thread', ttl=15 * 60, on_complete=None, max_queued=0):
+        self.workers = workers
+        self.worker_type = worker_type
+        self.ttl = ttl
+        self.on_complete = on_complete
+        self.max_queued = max_queued
+        self._jobs = {}
+        self._unfinished = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        # Created on first use so importing the app doesn't spawn workers
+        if self._executor is None:
+            if self.worker_type == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='snaptrack-job')
+        return self._executor
+
+    def _purge_expired(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['finished_at'] is not None and now - job['finished_at'] > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, fn, *args, **extra):
+        """Queue fn(*args) and return the new job id. extra is stored on the job record.
+        Raises JobQueueFull if the queue is at max_queued."""
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'created_at': time.time(),
+            'finished_at': None,
+            'result': None,
+            'error': None,
+        }
+        job.update(extra)
+        with self._lock:
+            # Process workers can't report when a job starts, so count every unfinished job
+            if self.max_queued and self._unfinished >= self.workers + self.max_queued:
+                raise JobQueueFull(f'{self.max_queued} jobs are already waiting')
+            self._purge_expired()
+            self._jobs[job_id] = job
+            self._unfinished += 1
+
+        if self.worker_type == 'process':
+            # A worker process can't update our records, so the job stays 'queued' until it finishes
+            future = self._get_executor().submit(fn, *args)
+        else:
+            future = self._get_executor().submit(self._run, job_id, fn, args)
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id
+
+    def _run(self, job_id, fn, args):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+        return fn(*args)
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            self._unfinished -= 1
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            try:
+                job['result'] = future.result()
+                job['status'] = 'done'
+            except Exception as e:
+                job['error'] = str(e)
+                job['status'] = 'error'
+            job['finished_at'] = time.time()
+            snapshot = dict(job)
+        if self.on_complete:
+            self.on_complete(snapshot)
+
+    def get(self, job_id):
+        """Copy of the job record, or None if unknown or expired"""
+        with self._lock:
+            self._purge_expired()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def counts(self):
+        """Number of jobs in each status"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return counts
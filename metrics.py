@@ -0,0 +1,163 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Latency buckets in seconds, spanning cache hits (ms) to slow Gemini calls (tens of s)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            return [f'{self.name}{_format_labels(key)} {value}' for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, such as requests in flight"""
+
+    type_name = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram; each observation is one bisect plus a few adds"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            # First bucket with bound >= value; past the last bound it only counts towards +Inf
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_format_labels(key, {"le": bound})} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(key, {"le": "+Inf"})} {series["count"]}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {series["sum"]}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {series["count"]}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name, help_text):
+        return self.register(Gauge(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'snaptrack_stage_seconds', 'Time spent in each pipeline stage')
+REQUEST_SECONDS = registry.histogram(
+    'snaptrack_request_seconds', 'End-to-end request handling time by endpoint')
+REQUESTS = registry.counter(
+    'snaptrack_requests_total', 'Requests handled, by endpoint and HTTP status')
+IN_FLIGHT = registry.gauge(
+    'snaptrack_requests_in_flight', 'Requests currently being handled, by endpoint')
+PROVIDER_RESULTS = registry.counter(
+    'snaptrack_provider_results_total', 'Provider calls by provider and outcome (success/error/cancelled)')
+FALLBACKS = registry.counter(
+    'snaptrack_fallbacks_total', 'Analyses served by Vision, by reason')
+CACHE_LOOKUPS = registry.counter(
+    'snaptrack_cache_lookups_total', 'Result cache lookups by provider and result')
+UPLOAD_REJECTIONS = registry.counter(
+    'snaptrack_upload_rejections_total', 'Uploads refused before any provider call, by reason')
+PROVIDER_REJECTIONS = registry.counter(
+    'snaptrack_provider_rejections_total', 'Provider calls not made, by provider and reason (quota/circuit_open)')
+JOB_REJECTIONS = registry.counter(
+    'snaptrack_job_rejections_total', 'Background jobs refused because the job queue was full')
+PRESCREEN_THRESHOLDS = registry.gauge(
+    'snaptrack_prescreen_threshold', 'Configured image pre-screen thresholds, by threshold')
+PRESCREEN_MEASUREMENTS = registry.histogram(
+    'snaptrack_prescreen_measurement', 'Pre-screen measurements of uploads (brightness, contrast, sharpness)',
+    buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 250))
+
+
+@contextmanager
+def timed(stage):
+    """Observe the duration of the with-block under snaptrack_stage_seconds{stage=...}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
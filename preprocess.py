@@ -0,0 +1,71 @@
+import io
+import time
+
+from image_buffer import UploadedImage
+
+FORMAT_EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+
+def flatten_to_rgb(image):
+    """The image as RGB, with any transparency flattened onto white - JPEG has no
+    alpha channel. Also takes just the current (first) frame of animated GIF/WebP."""
+    import PIL.Image
+
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        flattened = PIL.Image.new('RGB', rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.split()[-1])
+        return flattened
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def normalize_image(upload, max_dimension=1536, format='JPEG', quality=85):
+    """Prepare an upload for a provider: apply EXIF orientation, downscale so the
+    longest side is at most max_dimension, drop metadata and re-encode.
+
+    Returns (UploadedImage, stats). If re-encoding would not shrink an image
+    that needed no rotation or resizing and carries no metadata, the original
+    upload is returned.
+    """
+    import PIL.Image
+    import PIL.ImageOps
+
+    started = time.perf_counter()
+    image = upload.decoded()
+
+    exif = image.getexif()
+    rotated = exif.get(0x0112, 1) != 1  # EXIF Orientation tag
+    # EXIF can hold GPS coordinates, so an original carrying metadata is never sent as is
+    has_metadata = bool(exif) or any(key in image.info for key in ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp'))
+    oriented = PIL.ImageOps.exif_transpose(image) if rotated else image
+
+    oriented = flatten_to_rgb(oriented)
+
+    resized = max(oriented.size) > max_dimension
+    if resized:
+        oriented = oriented.copy()
+        oriented.thumbnail((max_dimension, max_dimension), PIL.Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    # Saving without exif/icc arguments strips the metadata
+    oriented.save(buffer, format=format, quality=quality, optimize=format == 'JPEG')
+    data = buffer.getvalue()
+
+    if not resized and not rotated and not has_metadata and len(data) >= len(upload.data):
+        normalized = upload
+    else:
+        filename = f"{upload.filename.rsplit('.', 1)[0]}.{FORMAT_EXTENSIONS.get(format, format.lower())}"
+        normalized = UploadedImage(data, filename)
+
+    stats = {
+        'original_bytes': len(upload.data),
+        'bytes': len(normalized.data),
+        'bytes_saved': len(upload.data) - len(normalized.data),
+        'original_size': list(upload.original_size or image.size),
+        'size': list(oriented.size),
+        'reencoded': normalized is not upload,
+        'ms': round((time.perf_counter() - started) * 1000, 2),
+    }
+    return normalized, stats
@@ -0,0 +1,53 @@
+from preprocess import flatten_to_rgb
+from upload_guard import UploadRejected
+
+# Checked in this order; the first failure is the rejection reason
+CHECKS = (
+    ('too_dark', 'brightness', 'min_brightness', 'The photo is too dark to analyze'),
+    ('too_bright', 'brightness', 'max_brightness', 'The photo is too overexposed to analyze'),
+    ('blank', 'contrast', 'min_contrast', 'The photo appears to be blank'),
+    ('blurry', 'sharpness', 'min_sharpness', 'The photo is too blurry to analyze'),
+)
+
+
+def measure_image(image, size=256):
+    """Brightness, contrast and sharpness of a PIL image, measured on a grayscale
+    copy (transparency flattened onto white) downscaled so its longest side is at most size.
+
+    brightness is the mean pixel value (0-255) and contrast its standard
+    deviation. sharpness is the variance of the Laplacian divided by the pixel
+    variance, so it doesn't depend on how bright or contrasty the photo is.
+    """
+    import numpy as np
+    import PIL.Image
+
+    if image.mode != 'L':
+        # Transparent areas are measured as the white they become in normalize_image
+        image = flatten_to_rgb(image)
+    scale = size / max(image.size)
+    if scale < 1:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             PIL.Image.BILINEAR, reducing_gap=2.0)
+    gray = np.asarray(image.convert('L'), dtype=np.float32)
+
+    laplacian = gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1]
+    variance = float(gray.var())
+    return {
+        'brightness': round(float(gray.mean()), 2),
+        'contrast': round(variance ** 0.5, 2),
+        'sharpness': round(float(laplacian.var()) / variance, 5) if variance and laplacian.size else 0.0,
+    }
+
+
+def check_measurements(measurements, thresholds):
+    """Raise UploadRejected (422) for the first measurement outside its threshold.
+    A threshold of None skips that check."""
+    for reason, measure, threshold, message in CHECKS:
+        limit = thresholds.get(threshold)
+        if limit is None:
+            continue
+        value = measurements[measure]
+        failed = value > limit if threshold.startswith('max_') else value < limit
+        if failed:
+            raise UploadRejected(reason, message, 422,
+                                 details={'measurements': measurements, 'threshold': {threshold: limit}})
@@ -0,0 +1,208 @@
+import time
+import asyncio
+import threading
+
+
+class ProviderUnavailable(Exception):
+    """A provider call was not made: its quota is spent or its circuit is open.
+
+    reason is 'quota' or 'circuit_open'.
+    """
+
+    def __init__(self, provider, reason, message):
+        super().__init__(message)
+        self.provider = provider
+        self.reason = reason
+
+
+class TokenBucket:
+    """rate_per_minute tokens refill continuously up to burst; a rate of 0 means unlimited"""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Take a token if one is available. Returns seconds until one will be (0 if taken)."""
+        if not self.rate:
+            return 0.0
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def available(self):
+        if not self.rate:
+            return None
+        self._refill(time.monotonic())
+        return round(self.tokens, 2)
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures; after reset_timeout one
+    half-open probe call is let through and its outcome closes or re-opens it.
+    A probe with no outcome after probe_timeout is given up on and another is let
+    through. A failure_threshold of 0 disables the breaker."""
+
+    def __init__(self, failure_threshold, reset_timeout, probe_timeout=60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.probe_started = None
+
+    def allow(self):
+        if self.state == 'closed':
+            return True
+        now = time.monotonic()
+        if self.state == 'open' and now - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+        if self.state == 'half_open' and self.probe_in_flight and now - self.probe_started >= self.probe_timeout:
+            # The probe's caller never reported back
+            self.probe_in_flight = False
+        if self.state == 'half_open' and not self.probe_in_flight:
+            self.probe_in_flight = True
+            self.probe_started = now
+            return True
+        return False
+
+    def record(self, success):
+        self.probe_in_flight = False
+        if success:
+            self.state = 'closed'
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == 'half_open' or (self.failure_threshold and self.failures >= self.failure_threshold):
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """A call was cancelled before it had an outcome. During a probe that counts as
+        a failed probe, since it may have been the probe; otherwise it is ignored."""
+        if self.state == 'half_open' and self.probe_in_flight:
+            self.record(False)
+
+
+class ProviderScheduler:
+    """Admission control in front of one provider: token bucket, bounded wait queue
+    and circuit breaker. Call acquire() (or acquire_async()) before each provider
+    call and record() with its outcome, or abandon() if it was cancelled."""
+
+    def __init__(self, name, rate_per_minute=0, burst=1, max_wait=0.0, max_queue=0,
+                 failure_threshold=5, reset_timeout=30.0, probe_timeout=60.0):
+        self.name = name
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, probe_timeout)
+        self.waiting = 0
+        self.stats = {'admitted': 0, 'rejected_quota': 0, 'rejected_circuit_open': 0}
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        """Returns (admitted, seconds to wait for a token); caller holds the lock"""
+        if not self.breaker.allow():
+            self.stats['rejected_circuit_open'] += 1
+            raise ProviderUnavailable(self.name, 'circuit_open',
+                                      f'{self.name} circuit breaker is open after repeated errors')
+        wait = self.bucket.take()
+        if wait == 0:
+            self.stats['admitted'] += 1
+            return True, 0.0
+        # A half-open probe that can't get a token doesn't count as the probe
+        self.breaker.probe_in_flight = False
+        return False, wait
+
+    def _reject_quota(self):
+        self.stats['rejected_quota'] += 1
+        return ProviderUnavailable(self.name, 'quota', f'{self.name} request budget exhausted')
+
+    def _enqueue(self, first_wait):
+        """Join the wait queue if the token is due within max_wait and there's room"""
+        if first_wait > self.max_wait or self.waiting >= self.max_queue:
+            raise self._reject_quota()
+        self.waiting += 1
+
+    def acquire(self):
+        """Block until the call may go ahead, or raise ProviderUnavailable"""
+        deadline = time.monotonic() + self.max_wait
+        with self._lock:
+            admitted, wait = self._admit()
+            if admitted:
+                return
+            self._enqueue(wait)
+        try:
+            while True:
+                time.sleep(min(wait, max(0.0, deadline - time.monotonic())))
+                with self._lock:
+                    admitted, wait = self._admit()
+                    if admitted:
+                        return
+                    if time.monotonic() + wait > deadline:
+                        raise self._reject_quota()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    async def acquire_async(self):
+        """acquire() for the event loop: waits for a token without blocking other requests"""
+        deadline = time.monotonic() + self.max_wait
+        with self._lock:
+            admitted, wait = self._admit()
+            if admitted:
+                return
+            self._enqueue(wait)
+        try:
+            while True:
+                await asyncio.sleep(min(wait, max(0.0, deadline - time.monotonic())))
+                with self._lock:
+                    admitted, wait = self._admit()
+                    if admitted:
+                        return
+                    if time.monotonic() + wait > deadline:
+                        raise self._reject_quota()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def record(self, success):
+        with self._lock:
+            self.breaker.record(success)
+
+    def abandon(self):
+        with self._lock:
+            self.breaker.abandon()
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {
+                'rate_per_minute': self.bucket.rate * 60,
+                'burst': self.bucket.burst,
+                'tokens_available': self.bucket.available(),
+                'waiting': self.waiting,
+                'max_wait': self.max_wait,
+                'breaker': {
+                    'state': self.breaker.state,
+                    'consecutive_failures': self.breaker.failures,
+                },
+            }
+            if self.breaker.state == 'open':
+                retry_in = self.breaker.reset_timeout - (time.monotonic() - self.breaker.opened_at)
+                if retry_in > 0:
+                    snapshot['breaker']['retry_in'] = round(retry_in, 1)
+                else:
+                    # The next call will be the half-open probe
+                    snapshot['breaker']['state'] = 'half_open'
+            snapshot.update(self.stats)
+        return snapshot
@@ -0,0 +1,276 @@
+import os
+import io
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# dHash grid side; the hash has HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+
+
+def content_hash(image_data):
+    """Exact cache key: SHA-256 of the raw upload bytes"""
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def perceptual_signature(image_data, image=None):
+    """Near-duplicate signature of the image, or None if it can't be decoded.
+
+    A dHash alone mostly captures the layout (plate, table edge), so two
+    different dishes photographed the same way can hash identically. The
+    signature therefore also keeps the aspect ratio and a 4x4 colour
+    thumbnail, and signatures_match() requires all three to agree.
+    Pass an already decoded PIL image to avoid decoding image_data again.
+    """
+    try:
+        import PIL.Image
+        if image is None:
+            image = PIL.Image.open(io.BytesIO(image_data))
+            # draft() lets the JPEG decoder skip most of the work for tiny targets
+            image.draft('RGB', (64, 64))
+        rgb = image.convert('RGB')
+        gray = list(rgb.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), PIL.Image.BILINEAR).tobytes())
+        colors = list(rgb.resize((4, 4), PIL.Image.BOX).tobytes())
+    except Exception:
+        return None
+
+    # 256-bit difference hash: each bit says whether a pixel is brighter than its right neighbour
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = gray[row * (HASH_SIZE + 1) + col]
+            right = gray[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    # A featureless image (blank, solid colour) hashes to 0 and would match
+    # every other featureless image, so it only gets exact-match caching
+    if not value:
+        return None
+    return {'hash': value, 'aspect': round(image.width / image.height, 3), 'colors': colors}
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two perceptual hashes"""
+    return bin(a ^ b).count('1')
+
+
+def signatures_match(a, b, max_distance, color_tolerance, aspect_tolerance=0.02):
+    """Whether two perceptual signatures are the same photo: hashes within max_distance
+    bits, aspect ratios within aspect_tolerance (relative), and no colour-thumbnail
+    channel differing by more than color_tolerance (0-255). Returns the hash distance or None."""
+    if abs(a['aspect'] - b['aspect']) > aspect_tolerance * max(a['aspect'], b['aspect']):
+        return None
+    distance = hamming_distance(a['hash'], b['hash'])
+    if distance > max_distance:
+        return None
+    # The worst cell, not the average: a different dish only changes the cells it covers
+    if max(abs(x - y) for x, y in zip(a['colors'], b['colors'])) > color_tolerance:
+        return None
+    return distance
+
+
+class ResultCache:
+    """Two-tier (memory LRU + optional disk) cache for provider results.
+
+    Entries are keyed by (kind, content hash). With phash_distance set, each
+    entry also remembers the perceptual signature of its image so
+    near-identical uploads can be matched; None turns that tier off.
+    """
+
+    def __init__(self, max_entries=256, disk_dir=None, ttl=24 * 60 * 60,
+                 max_disk_entries=5000, phash_distance=None, color_tolerance=24):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self.phash_distance = phash_distance
+        self.color_tolerance = color_tolerance
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'memory_hits': 0, 'disk_hits': 0, 'perceptual_hits': 0}
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    # ----- memory tier -----
+
+    def _memory_get(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return entry
+
+    def _memory_find_similar(self, kind, signature):
+        best_key, best_distance = None, None
+        for key, entry in self._memory.items():
+            if key[0] != kind or entry.get('signature') is None or self._expired(entry):
+                continue
+            distance = self._match(signature, entry['signature'])
+            if distance is not None and (best_distance is None or distance < best_distance):
+                best_key, best_distance = key, distance
+        if best_key is None:
+            return None
+        self._memory.move_to_end(best_key)
+        return self._memory[best_key]
+
+    def _match(self, a, b):
+        return signatures_match(a, b, self.phash_distance, self.color_tolerance)
+
+    def _memory_put(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # ----- disk tier -----
+
+    def _disk_path(self, kind, name):
+        return os.path.join(self.disk_dir, f"{kind}-{name}.json")
+
+    def _disk_get(self, path):
+        try:
+            with io.open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _disk_put(self, kind, digest, entry):
+        payload = json.dumps(entry)
+        paths = [self._disk_path(kind, digest)]
+        if entry.get('signature') is not None:
+            # Alias file so an identical perceptual hash is found without a scan
+            paths.append(self._disk_path(kind, f"p{entry['signature']['hash']:064x}"))
+        for path in paths:
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with io.open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+        self._disk_evict()
+
+    def _disk_evict(self):
+        """Drop expired entries and trim the oldest ones beyond max_disk_entries"""
+        try:
+            names = [n for n in os.listdir(self.disk_dir) if n.endswith('.json')]
+        except OSError:
+            return
+        if len(names) <= self.max_disk_entries:
+            return
+
+        now = time.time()
+        files = []
+        for name in names:
+            path = os.path.join(self.disk_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if self.ttl and now - mtime > self.ttl:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            else:
+                files.append((mtime, path))
+
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_disk_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # ----- public API -----
+
+    def _expired(self, entry):
+        return bool(self.ttl) and time.time() - entry.get('created', 0) > self.ttl
+
+    def get(self, kind, image_data, decode=None):
+        """Look up a cached result. decode optionally returns an already-decoded
+        PIL image for image_data; it is only called on an exact-match miss.
+
+        Returns (result, hit_type, keys) where hit_type is 'memory', 'disk',
+        'perceptual' or None, and keys can be passed back to put().
+        """
+        digest = content_hash(image_data)
+        key = (kind, digest)
+
+        with self._lock:
+            entry = self._memory_get(key)
+            if entry is not None:
+                self.stats['hits'] += 1
+                self.stats['memory_hits'] += 1
+                return entry['result'], 'memory', (digest, entry.get('signature'))
+
+        if self.disk_dir:
+            entry = self._disk_get(self._disk_path(kind, digest))
+            if entry is not None:
+                with self._lock:
+                    self._memory_put(key, entry)
+                    self.stats['hits'] += 1
+                    self.stats['disk_hits'] += 1
+                return entry['result'], 'disk', (digest, entry.get('signature'))
+
+        if self.phash_distance is None:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None, None, (digest, None)
+
+        image = None
+        if decode is not None:
+            try:
+                image = decode()
+            except Exception:
+                image = None
+        signature = perceptual_signature(image_data, image)
+        if signature is not None:
+            with self._lock:
+                entry = self._memory_find_similar(kind, signature)
+                if entry is not None:
+                    self.stats['hits'] += 1
+                    self.stats['perceptual_hits'] += 1
+                    return entry['result'], 'perceptual', (digest, signature)
+
+            if self.disk_dir:
+                entry = self._disk_get(self._disk_path(kind, f"p{signature['hash']:064x}"))
+                # The alias only guarantees the same hash; aspect and colours still have to agree
+                if entry is not None and entry.get('signature') and self._match(signature, entry['signature']) is not None:
+                    with self._lock:
+                        self._memory_put(key, entry)
+                        self.stats['hits'] += 1
+                        self.stats['perceptual_hits'] += 1
+                    return entry['result'], 'perceptual', (digest, signature)
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None, None, (digest, signature)
+
+    def put(self, kind, keys, result):
+        """Store a provider result under the keys returned by get()"""
+        digest, signature = keys
+        entry = {'result': result, 'signature': signature, 'created': time.time()}
+        with self._lock:
+            self._memory_put((kind, digest), entry)
+        if self.disk_dir:
+            self._disk_put(kind, digest, entry)
+
+    def snapshot(self):
+        """Copy of the hit/miss counters"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['memory_entries'] = len(self._memory)
+        return stats
@@ -0,0 +1,14 @@
+import os
+import sys
+
+# The app's modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests that import app run it offline against the fake providers, uncached
+os.environ.update({
+    'SNAPTRACK_FAKE_PROVIDERS': 'true',
+    'SNAPTRACK_PROVIDER_WORKERS': '4',
+    'SNAPTRACK_CACHE_SIZE': '0',
+    'SNAPTRACK_PRESCREEN': 'false',
+    'SNAPTRACK_GEMINI_BREAKER_THRESHOLD': '0',
+})
@@ -0,0 +1,128 @@
+import asyncio
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import PIL.Image
+import pytest
+
+import app as snaptrack
+from fakes import FakeGenerativeModel, FakeImageAnnotatorClient
+from image_buffer import UploadedImage
+from quota import CircuitBreaker
+
+
+def jpeg(seed=0):
+    image = PIL.Image.effect_noise((320, 240), 40 + seed).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Set fake provider latencies in ms and the hedge settings; restored afterwards"""
+    for cls in (FakeGenerativeModel, FakeImageAnnotatorClient):
+        monkeypatch.setattr(cls, 'latency', cls.latency)
+        monkeypatch.setattr(cls, 'error_rate', 0.0)
+    monkeypatch.setitem(snaptrack.app.config, 'HEDGE_DELAY', 0.1)
+    monkeypatch.setitem(snaptrack.app.config, 'REQUEST_DEADLINE', 0.6)
+
+    def configure(gemini, vision):
+        FakeGenerativeModel.configure(latency=f'fixed:{gemini}')
+        FakeImageAnnotatorClient.configure(latency=f'fixed:{vision}')
+    return configure
+
+
+def wait_for_idle_gemini_pool(timeout=5):
+    deadline = time.monotonic() + timeout
+    while snaptrack.gemini_calls_pending and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+
+def test_fast_gemini_wins(providers):
+    providers(gemini=20, vision=20)
+    gemini_result, vision_items, hedge_info = snaptrack.run_hedged(UploadedImage(jpeg(), 'meal.jpg'), {}, 'hedged')
+    assert gemini_result['source'] == 'gemini'
+    assert vision_items == []
+    assert hedge_info['winner'] == 'gemini'
+    assert 'vision_started_ms' not in hedge_info
+
+
+def test_slow_gemini_is_hedged_by_vision(providers):
+    providers(gemini=2000, vision=20)
+    gemini_result, vision_items, hedge_info = snaptrack.run_hedged(UploadedImage(jpeg(), 'meal.jpg'), {}, 'hedged')
+    assert gemini_result is None
+    assert vision_items
+    assert hedge_info['winner'] == 'vision'
+    assert hedge_info['gemini_timed_out']
+    # Vision's answer is held until the deadline in case Gemini still makes it
+    assert 600 <= hedge_info['elapsed_ms'] < 1000
+
+
+def test_gemini_timeout_frees_its_worker(providers):
+    providers(gemini=5000, vision=20)
+    snaptrack.run_hedged(UploadedImage(jpeg(), 'meal.jpg'), {}, 'hedged')
+    # The call was bounded by the request deadline, not Gemini's 5s latency
+    started = time.monotonic()
+    wait_for_idle_gemini_pool()
+    assert snaptrack.gemini_calls_pending == 0
+    assert time.monotonic() - started < 1.5
+
+
+def test_vision_hedge_does_not_queue_behind_abandoned_gemini_calls(providers, monkeypatch):
+    # An SDK without per-call timeouts: every losing Gemini call keeps its worker thread
+    monkeypatch.setattr(snaptrack, 'gemini_call_options', lambda model, timeout: {})
+    providers(gemini=1500, vision=30)
+    client = snaptrack.app.test_client()
+
+    def upload(seed):
+        response = client.post('/upload', data={'file': (io.BytesIO(jpeg(seed)), 'meal.jpg')})
+        return response.status_code, response.get_json().get('source')
+
+    monkeypatch.setitem(snaptrack.app.config, 'ANALYSIS_MODE', 'hedged')
+    # Twice the Gemini pool size, twice over, so later requests find every Gemini worker held
+    for batch in range(2):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            outcomes = list(executor.map(upload, range(batch * 8, batch * 8 + 8)))
+        assert outcomes == [(200, 'vision_api')] * 8
+    wait_for_idle_gemini_pool()
+
+
+def test_parallel_mode_prefers_gemini_within_deadline(providers):
+    providers(gemini=150, vision=10)
+    gemini_result, _, hedge_info = snaptrack.run_hedged(UploadedImage(jpeg(), 'meal.jpg'), {}, 'parallel')
+    assert gemini_result['source'] == 'gemini'
+    assert hedge_info['vision_started_ms'] < 50
+
+
+def test_async_fast_gemini_wins(providers):
+    providers(gemini=20, vision=20)
+    gemini_result, _, hedge_info = asyncio.run(
+        snaptrack.run_hedged_async(UploadedImage(jpeg(), 'meal.jpg'), {}, 'hedged'))
+    assert gemini_result['source'] == 'gemini'
+    assert hedge_info['winner'] == 'gemini'
+
+
+def test_async_slow_gemini_is_hedged_and_cancelled(providers):
+    providers(gemini=5000, vision=20)
+    started = time.monotonic()
+    gemini_result, vision_items, hedge_info = asyncio.run(
+        snaptrack.run_hedged_async(UploadedImage(jpeg(), 'meal.jpg'), {}, 'hedged'))
+    assert gemini_result is None
+    assert vision_items
+    assert hedge_info['winner'] == 'vision'
+    assert time.monotonic() - started < 1.5
+
+
+def test_async_cancelled_probe_does_not_wedge_the_breaker(providers, monkeypatch):
+    providers(gemini=5000, vision=20)
+    monkeypatch.setitem(snaptrack.app.config, 'GEMINI_OUTPUT_MODE', 'detailed')
+    scheduler = snaptrack.provider_schedulers['gemini']
+    monkeypatch.setattr(scheduler, 'breaker', CircuitBreaker(1, 0.0))
+    scheduler.record(False)
+
+    # The half-open probe is the Gemini call the hedge cancels at the deadline
+    asyncio.run(snaptrack.run_hedged_async(UploadedImage(jpeg(), 'meal.jpg'), {}, 'hedged'))
+    assert not scheduler.breaker.probe_in_flight
+    assert scheduler.breaker.allow()
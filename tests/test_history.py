@@ -0,0 +1,122 @@
+import pytest
+
+from history import MealHistory, decode_cursor, encode_cursor, local_day
+
+DAY = 86400
+START = 1_700_000_000.0  # 2023-11-14 22:13:20 UTC
+
+
+def meal(*descriptions, source='gemini'):
+    return {'source': source, 'items': [{'description': d} for d in descriptions], 'full_description': ''}
+
+
+@pytest.fixture
+def history(tmp_path):
+    return MealHistory(str(tmp_path / 'history.db'), batch_size=7, flush_interval=0.01)
+
+
+def all_pages(history, user_id, limit, **filters):
+    pages, cursor = [], None
+    while True:
+        meals, cursor = history.meals(user_id, limit=limit, cursor=cursor, **filters)
+        pages.append(meals)
+        if cursor is None:
+            return pages
+
+
+def test_local_day_uses_utc_offset():
+    assert local_day(START) == '2023-11-14'
+    assert local_day(START, utc_offset_minutes=120) == '2023-11-15'
+    assert local_day(START, utc_offset_minutes=-23 * 60) == '2023-11-13'
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(START + 0.123456, 42)) == (START + 0.123456, 42)
+    for malformed in ('', 'abc', '1:2:3', 'x:1', '1.5:y'):
+        with pytest.raises(ValueError):
+            decode_cursor(malformed)
+
+
+def test_meals_pages_newest_first_without_gaps_or_repeats(history):
+    for i in range(25):
+        history.record('u1', meal(f'dish {i}'), recorded_at=START + i)
+    history.flush()
+
+    pages = all_pages(history, 'u1', limit=10)
+    assert [len(page) for page in pages] == [10, 10, 5]
+    times = [m['recorded_at'] for page in pages for m in page]
+    assert times == sorted((START + i for i in range(25)), reverse=True)
+
+
+def test_meals_with_equal_timestamps_page_by_id(history):
+    for i in range(5):
+        history.record('u1', meal(f'dish {i}'), recorded_at=START)
+    history.flush()
+
+    pages = all_pages(history, 'u1', limit=2)
+    ids = [m['id'] for page in pages for m in page]
+    assert ids == sorted(ids, reverse=True)
+    assert len(set(ids)) == 5
+
+
+def test_exact_last_page_has_no_cursor(history):
+    for i in range(4):
+        history.record('u1', meal('soup'), recorded_at=START + i)
+    history.flush()
+
+    meals, cursor = history.meals('u1', limit=4)
+    assert len(meals) == 4
+    assert cursor is None
+
+
+def test_meals_are_per_user_and_filter_by_day(history):
+    history.record('u1', meal('toast'), recorded_at=START)
+    history.record('u1', meal('pasta'), recorded_at=START + DAY)
+    history.record('u2', meal('salad'), recorded_at=START)
+    history.flush()
+
+    meals, _ = history.meals('u1')
+    assert [m['items'][0]['description'] for m in meals] == ['pasta', 'toast']
+    meals, _ = history.meals('u1', day=local_day(START + DAY))
+    assert [m['items'][0]['description'] for m in meals] == ['pasta']
+    assert history.meals('u3') == ([], None)
+
+
+def test_daily_summaries_roll_up_across_batches(history):
+    # batch_size is 7, so the day is built from more than one write transaction
+    for i in range(10):
+        history.record('u1', meal('Coffee ', 'croissant' if i % 2 else 'bagel'), recorded_at=START + i)
+    history.record('u1', meal('pizza'), recorded_at=START + DAY)
+    history.flush()
+
+    days, cursor = history.daily_summaries('u1')
+    assert cursor is None
+    assert [d['day'] for d in days] == [local_day(START + DAY), local_day(START)]
+    summary = days[1]
+    assert summary['meal_count'] == 10
+    assert summary['item_count'] == 20
+    assert summary['items'] == {'coffee': 10, 'croissant': 5, 'bagel': 5}
+    assert (summary['first_at'], summary['last_at']) == (START, START + 9)
+    assert history.stats['batches'] >= 2
+
+
+def test_daily_summaries_paginate_by_day(history):
+    for i in range(5):
+        history.record('u1', meal('rice'), recorded_at=START + i * DAY)
+    history.flush()
+
+    days, cursor = history.daily_summaries('u1', limit=2)
+    seen = [d['day'] for d in days]
+    while cursor:
+        days, cursor = history.daily_summaries('u1', limit=2, before=cursor)
+        seen += [d['day'] for d in days]
+    assert seen == [local_day(START + i * DAY) for i in reversed(range(5))]
+
+
+def test_record_drops_meals_when_queue_is_full(tmp_path):
+    history = MealHistory(str(tmp_path / 'history.db'), max_queue=1)
+    # Hold the writer back by filling the queue before it starts
+    history._writer = object()
+    assert history.record('u1', meal('tea'))
+    assert not history.record('u1', meal('tea'))
+    assert history.snapshot()['dropped'] == 1
@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueueFull, JobStore
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_job_result_is_polled():
+    store = JobStore(workers=1)
+    job_id = store.submit(lambda x: x * 2, 21, filename='meal.jpg')
+    wait_for(lambda: store.get(job_id)['status'] == 'done')
+    job = store.get(job_id)
+    assert job['result'] == 42
+    assert job['filename'] == 'meal.jpg'
+
+
+def test_job_error_is_recorded():
+    def fail():
+        raise ValueError('bad image')
+    store = JobStore(workers=1)
+    job_id = store.submit(fail)
+    wait_for(lambda: store.get(job_id)['status'] == 'error')
+    assert store.get(job_id)['error'] == 'bad image'
+
+
+def test_submit_refused_once_queue_is_full():
+    release = threading.Event()
+    store = JobStore(workers=1, max_queued=2)
+    job_ids = [store.submit(release.wait) for _ in range(3)]  # one running, two waiting
+    with pytest.raises(JobQueueFull):
+        store.submit(release.wait)
+
+    release.set()
+    wait_for(lambda: all(store.get(job_id)['status'] == 'done' for job_id in job_ids))
+    store.submit(release.wait)
+
+
+def test_zero_max_queued_is_unlimited():
+    release = threading.Event()
+    store = JobStore(workers=1, max_queued=0)
+    for _ in range(50):
+        store.submit(release.wait)
+    release.set()
@@ -0,0 +1,40 @@
+import PIL.Image
+import PIL.ImageDraw
+import pytest
+
+from prescreen import check_measurements, measure_image
+from upload_guard import UploadRejected
+
+THRESHOLDS = {'min_brightness': 20, 'max_brightness': 250, 'min_contrast': 5, 'min_sharpness': 0.001}
+
+
+def cutout(mode='RGBA'):
+    """A small item on a transparent background, like a product photo cutout"""
+    image = PIL.Image.new('RGBA', (400, 400), (0, 0, 0, 0))
+    PIL.ImageDraw.Draw(image).ellipse((150, 150, 250, 250), fill=(200, 120, 40, 255))
+    return image.convert(mode)
+
+
+@pytest.mark.parametrize('mode', ['RGBA', 'LA', 'PA'])
+def test_transparent_background_is_measured_as_white(mode):
+    measurements = measure_image(cutout(mode))
+    assert measurements['brightness'] > 200
+    check_measurements(measurements, THRESHOLDS)
+
+
+def test_dark_photo_is_rejected():
+    with pytest.raises(UploadRejected) as excinfo:
+        check_measurements(measure_image(PIL.Image.new('RGB', (64, 64), (5, 5, 5))), THRESHOLDS)
+    assert excinfo.value.reason == 'too_dark'
+    assert excinfo.value.status == 422
+
+
+def test_blank_photo_is_rejected():
+    with pytest.raises(UploadRejected) as excinfo:
+        check_measurements(measure_image(PIL.Image.new('L', (64, 64), 128)), THRESHOLDS)
+    assert excinfo.value.reason == 'blank'
+
+
+def test_threshold_none_skips_check():
+    measurements = measure_image(PIL.Image.new('RGB', (64, 64), (5, 5, 5)))
+    check_measurements(measurements, dict.fromkeys(THRESHOLDS))
@@ -0,0 +1,173 @@
+import pytest
+
+import quota
+from quota import CircuitBreaker, ProviderScheduler, ProviderUnavailable, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(quota.time, 'monotonic', clock)
+    return clock
+
+
+def open_breaker(threshold=2, reset_timeout=10, probe_timeout=60):
+    breaker = CircuitBreaker(threshold, reset_timeout, probe_timeout)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.record(False)
+    return breaker
+
+
+def test_bucket_spends_burst_then_refills(clock):
+    bucket = TokenBucket(rate_per_minute=60, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(1.0)
+    clock.advance(1.0)
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(1.0)
+
+
+def test_bucket_never_exceeds_burst(clock):
+    bucket = TokenBucket(rate_per_minute=60, burst=2)
+    clock.advance(3600)
+    assert bucket.available() == 2
+
+
+def test_bucket_rate_zero_is_unlimited(clock):
+    bucket = TokenBucket(rate_per_minute=0, burst=1)
+    assert all(bucket.take() == 0 for _ in range(100))
+    assert bucket.available() is None
+
+
+def test_breaker_opens_after_threshold_consecutive_failures(clock):
+    breaker = CircuitBreaker(3, 10)
+    for _ in range(2):
+        breaker.record(False)
+    breaker.record(True)
+    for _ in range(2):
+        breaker.record(False)
+    assert breaker.state == 'closed'
+    breaker.record(False)
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_breaker_threshold_zero_never_opens(clock):
+    breaker = CircuitBreaker(0, 10)
+    for _ in range(50):
+        breaker.record(False)
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_breaker_half_open_lets_one_probe_through(clock):
+    breaker = open_breaker()
+    clock.advance(9.9)
+    assert not breaker.allow()
+    clock.advance(0.1)
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+
+
+def test_breaker_successful_probe_closes(clock):
+    breaker = open_breaker()
+    clock.advance(10)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed'
+    assert breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens(clock):
+    breaker = open_breaker()
+    clock.advance(10)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    clock.advance(10)
+    assert breaker.allow()
+
+
+def test_breaker_abandoned_probe_reopens(clock):
+    breaker = open_breaker()
+    clock.advance(10)
+    assert breaker.allow()
+    breaker.abandon()
+    assert breaker.state == 'open'
+    assert not breaker.probe_in_flight
+    clock.advance(10)
+    assert breaker.allow()
+
+
+def test_breaker_abandon_outside_probe_changes_nothing(clock):
+    breaker = CircuitBreaker(2, 10)
+    breaker.record(False)
+    breaker.abandon()
+    assert breaker.state == 'closed'
+    assert breaker.failures == 1
+
+
+def test_breaker_lost_probe_times_out(clock):
+    breaker = open_breaker(probe_timeout=30)
+    clock.advance(10)
+    assert breaker.allow()
+    # The probe's caller never calls record() or abandon()
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'closed'
+
+
+def test_scheduler_rejects_when_budget_spent(clock):
+    scheduler = ProviderScheduler('gemini', rate_per_minute=2, burst=1, max_wait=0, max_queue=0)
+    scheduler.acquire()
+    with pytest.raises(ProviderUnavailable) as excinfo:
+        scheduler.acquire()
+    assert excinfo.value.reason == 'quota'
+    assert scheduler.stats['rejected_quota'] == 1
+
+
+def test_scheduler_rejects_while_circuit_open(clock):
+    scheduler = ProviderScheduler('gemini', failure_threshold=1, reset_timeout=10)
+    scheduler.acquire()
+    scheduler.record(False)
+    with pytest.raises(ProviderUnavailable) as excinfo:
+        scheduler.acquire()
+    assert excinfo.value.reason == 'circuit_open'
+    assert scheduler.snapshot()['breaker']['retry_in'] == 10
+    clock.advance(10)
+    assert scheduler.snapshot()['breaker']['state'] == 'half_open'
+    scheduler.acquire()
+    scheduler.abandon()
+    assert scheduler.snapshot()['breaker']['state'] == 'open'
+
+
+def test_scheduler_probe_without_token_frees_the_probe_slot(clock):
+    scheduler = ProviderScheduler('gemini', rate_per_minute=1, burst=1, failure_threshold=1, reset_timeout=10)
+    scheduler.acquire()
+    scheduler.record(False)
+    clock.advance(10)
+    # The bucket is still empty, so the probe is refused for quota, not held
+    scheduler.bucket.tokens = 0
+    with pytest.raises(ProviderUnavailable) as excinfo:
+        scheduler.acquire()
+    assert excinfo.value.reason == 'quota'
+    assert not scheduler.breaker.probe_in_flight
@@ -0,0 +1,106 @@
+import io
+
+import PIL.Image
+import PIL.ImageDraw
+import pytest
+
+from result_cache import ResultCache, perceptual_signature, signatures_match
+
+STEW, SALAD, CURRY = (110, 60, 30), (60, 150, 50), (220, 180, 40)
+
+
+def plate_photo(food, size=(640, 480), quality=90):
+    """One plate on a wooden table; only the food's colour changes between dishes"""
+    image = PIL.Image.new('RGB', size, (150, 110, 70))
+    draw = PIL.ImageDraw.Draw(image)
+    width, height = size
+    draw.ellipse((width * 0.2, height * 0.1, width * 0.8, height * 0.9), fill=(245, 245, 240))
+    draw.ellipse((width * 0.32, height * 0.25, width * 0.68, height * 0.75), fill=food)
+    draw.rectangle((0, height * 0.92, width, height), fill=(90, 60, 40))
+    return encode(image, quality=quality)
+
+
+def encode(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def decoded(data):
+    return PIL.Image.open(io.BytesIO(data))
+
+
+@pytest.fixture
+def cache():
+    return ResultCache(max_entries=16, phash_distance=20)
+
+
+def store(cache, data, result):
+    _, hit_type, keys = cache.get('gemini', data)
+    assert hit_type is None
+    cache.put('gemini', keys, result)
+
+
+def test_exact_hit(cache):
+    data = plate_photo(STEW)
+    store(cache, data, {'items': ['stew']})
+    assert cache.get('gemini', data)[:2] == ({'items': ['stew']}, 'memory')
+
+
+def test_kinds_are_separate(cache):
+    data = plate_photo(STEW)
+    store(cache, data, {'items': ['stew']})
+    assert cache.get('vision', data)[1] is None
+
+
+def test_recompressed_copy_is_a_perceptual_hit(cache):
+    store(cache, plate_photo(STEW), {'items': ['stew']})
+    result, hit_type, _ = cache.get('gemini', plate_photo(STEW, quality=60))
+    assert (result, hit_type) == ({'items': ['stew']}, 'perceptual')
+
+
+def test_resized_copy_is_a_perceptual_hit(cache):
+    store(cache, plate_photo(STEW), {'items': ['stew']})
+    smaller = encode(decoded(plate_photo(STEW)).resize((480, 360), PIL.Image.LANCZOS))
+    assert cache.get('gemini', smaller)[1] == 'perceptual'
+
+
+def test_different_dishes_on_the_same_plate_miss(cache):
+    store(cache, plate_photo(STEW), {'items': ['stew']})
+    for food in (SALAD, CURRY):
+        assert cache.get('gemini', plate_photo(food))[1] is None
+
+
+def test_same_layout_differs_only_in_colour():
+    # The layout hash alone can't tell the dishes apart; the colour thumbnail does
+    stew, salad = (perceptual_signature(plate_photo(food)) for food in (STEW, SALAD))
+    assert signatures_match(stew, salad, max_distance=20, color_tolerance=255) is not None
+    assert signatures_match(stew, salad, max_distance=20, color_tolerance=24) is None
+
+
+def test_different_aspect_ratio_misses(cache):
+    store(cache, plate_photo(STEW), {'items': ['stew']})
+    assert cache.get('gemini', plate_photo(STEW, size=(640, 640)))[1] is None
+
+
+def test_perceptual_tier_is_off_by_default():
+    cache = ResultCache()
+    store(cache, plate_photo(STEW), {'items': ['stew']})
+    result, hit_type, keys = cache.get('gemini', plate_photo(STEW, quality=60))
+    assert hit_type is None
+    assert keys[1] is None
+
+
+def test_blank_image_only_gets_exact_matches(cache):
+    blank = encode(PIL.Image.new('RGB', (64, 64), 'white'))
+    assert perceptual_signature(blank) is None
+    store(cache, blank, {'items': []})
+    assert cache.get('gemini', encode(PIL.Image.new('RGB', (64, 64), 'white'), quality=50))[1] is None
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    data = plate_photo(STEW)
+    store(ResultCache(disk_dir=str(tmp_path), phash_distance=20), data, {'items': ['stew']})
+    fresh = ResultCache(disk_dir=str(tmp_path), phash_distance=20)
+    assert fresh.get('gemini', data)[1] == 'disk'
+    assert fresh.get('gemini', plate_photo(SALAD))[1] is None
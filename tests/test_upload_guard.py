@@ -0,0 +1,158 @@
+import io
+import struct
+
+import PIL.Image
+import pytest
+
+from upload_guard import GuardedStream, UploadRejected, check_dimensions, check_image, probe_image_header
+
+LIMITS = {
+    'allowed_extensions': {'png', 'jpg', 'jpeg', 'gif', 'webp'},
+    'max_pixels': 4000 * 4000,
+    'max_dimension': 4000,
+    'min_dimension': 16,
+    'probe_bytes': 64 * 1024,
+}
+
+
+def encode(format, size=(123, 45), mode='RGB', **options):
+    buffer = io.BytesIO()
+    PIL.Image.new(mode, size, 'orange').save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def assert_corrupt(head):
+    with pytest.raises(UploadRejected) as excinfo:
+        probe_image_header(head)
+    assert excinfo.value.reason == 'corrupt'
+
+
+@pytest.mark.parametrize('format, mime_type, options', [
+    ('PNG', 'image/png', {}),
+    ('GIF', 'image/gif', {}),
+    ('JPEG', 'image/jpeg', {}),
+    ('JPEG', 'image/jpeg', {'progressive': True}),
+    ('JPEG', 'image/jpeg', {'exif': b'Exif\x00\x00' + b'\x00' * 200}),
+    ('WEBP', 'image/webp', {'lossless': False}),
+    ('WEBP', 'image/webp', {'lossless': True}),
+    ('WEBP', 'image/webp', {'exif': b'Exif\x00\x00' + b'\x00' * 20}),
+])
+def test_probe_reads_declared_size(format, mime_type, options):
+    assert probe_image_header(encode(format, **options)) == (mime_type, (123, 45))
+
+
+@pytest.mark.parametrize('size', [(1, 1), (16383, 2), (3000, 4000)])
+def test_probe_webp_lossless_size_bit_packing(size):
+    # VP8L packs 14-bit width-1 and height-1 across byte boundaries
+    head = bytearray(encode('WEBP', size=(1, 1), lossless=True)[:25])
+    bits = (size[0] - 1) | (size[1] - 1) << 14
+    head[21:25] = struct.pack('<I', bits)
+    assert probe_image_header(bytes(head))[1] == size
+
+
+def test_probe_webp_extended_header_is_vp8x():
+    data = encode('WEBP', exif=b'Exif\x00\x00' + b'\x00' * 20)
+    assert data[12:16] == b'VP8X'
+
+
+def test_probe_jpeg_skips_fill_bytes():
+    data = encode('JPEG')
+    # Extra 0xFF padding before the first marker after SOI is allowed
+    padded = data[:2] + b'\xff\xff\xff' + data[2:]
+    assert probe_image_header(padded) == ('image/jpeg', (123, 45))
+
+
+def test_probe_short_head_is_unknown():
+    assert probe_image_header(b'\x89PNG') == (None, None)
+
+
+def test_probe_rejects_unknown_magic():
+    with pytest.raises(UploadRejected) as excinfo:
+        probe_image_header(b'%PDF-1.7\n' + b'\x00' * 100)
+    assert excinfo.value.reason == 'unsupported_type'
+    assert excinfo.value.status == 415
+
+
+@pytest.mark.parametrize('format, options', [
+    ('PNG', {}), ('JPEG', {'exif': b'Exif\x00\x00' + b'\x00' * 200}), ('WEBP', {'lossless': True}),
+])
+def test_probe_truncated_header_waits_for_more(format, options):
+    # GIF isn't here: its size is within the 12 bytes needed to identify it
+    data = encode(format, **options)
+    mime_type, size = probe_image_header(data[:13])
+    assert mime_type is not None
+    assert size is None
+
+
+def test_probe_jpeg_size_beyond_head_is_unknown():
+    data = encode('JPEG', exif=b'Exif\x00\x00' + b'\x00' * 2000)
+    assert probe_image_header(data[:1000]) == ('image/jpeg', None)
+
+
+def test_probe_jpeg_missing_marker_is_corrupt():
+    assert_corrupt(b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + b'\x00' * 5 + b'\x12\x34' + b'\x00' * 20)
+
+
+def test_probe_jpeg_bad_segment_length_is_corrupt():
+    assert_corrupt(b'\xff\xd8\xff\xe0\x00\x01' + b'\x00' * 30)
+
+
+def test_probe_jpeg_end_of_image_before_frame_is_corrupt():
+    assert_corrupt(b'\xff\xd8\xff\xd9\x00\x02' + b'\x00' * 30)
+
+
+def test_probe_webp_unknown_chunk_is_corrupt():
+    assert_corrupt(b'RIFF\x00\x00\x00\x00WEBPJUNK' + b'\x00' * 20)
+
+
+def test_check_dimensions_limits():
+    check_dimensions((16, 4000), LIMITS)
+    for size, reason in [((15, 100), 'too_small'), ((4001, 100), 'dimensions_too_large')]:
+        with pytest.raises(UploadRejected) as excinfo:
+            check_dimensions(size, LIMITS)
+        assert excinfo.value.reason == reason
+    with pytest.raises(UploadRejected) as excinfo:
+        check_dimensions((4000, 4000), dict(LIMITS, max_pixels=1000 * 1000))
+    assert excinfo.value.reason == 'too_many_pixels'
+
+
+def test_guarded_stream_rejects_extension_before_data():
+    with pytest.raises(UploadRejected) as excinfo:
+        GuardedStream('meal.exe', LIMITS)
+    assert excinfo.value.reason == 'extension'
+
+
+def test_guarded_stream_rejects_on_first_chunk():
+    stream = GuardedStream('meal.png', LIMITS)
+    with pytest.raises(UploadRejected) as excinfo:
+        stream.write(encode('PNG', size=(8, 8)))
+    assert excinfo.value.reason == 'too_small'
+
+
+def test_guarded_stream_screens_across_chunks():
+    data = encode('PNG')
+    stream = GuardedStream('meal.png', LIMITS)
+    stream.write(data[:10])
+    assert not stream.screened
+    stream.write(data[10:])
+    assert stream.screened
+    assert stream.getvalue() == data
+
+
+def test_guarded_stream_without_abort_discards_the_rest():
+    stream = GuardedStream('meal.gif', LIMITS, abort=False)
+    stream.write(b'not an image at all')
+    stream.write(b'more bytes')
+    assert stream.rejection.reason == 'unsupported_type'
+    assert stream.getvalue() == b''
+
+
+def test_check_image_accepts_valid_image():
+    check_image(encode('JPEG'), LIMITS)
+
+
+def test_check_image_rejects_truncated_body():
+    data = encode('PNG')
+    with pytest.raises(UploadRejected) as excinfo:
+        check_image(data[:30], LIMITS)
+    assert excinfo.value.reason == 'corrupt'
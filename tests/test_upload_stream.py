@@ -0,0 +1,71 @@
+import io
+import json
+
+import PIL.Image
+import pytest
+
+import app as snaptrack
+from fakes import FakeGenerativeModel, FakeImageAnnotatorClient
+
+
+def jpeg():
+    buffer = io.BytesIO()
+    PIL.Image.effect_noise((320, 240), 40).convert('RGB').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def events(body):
+    """[(event, data)] from an SSE response body"""
+    parsed = []
+    for block in body.strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        parsed.append((fields['event'], json.loads(fields['data'])))
+    return parsed
+
+
+@pytest.fixture
+def client(monkeypatch):
+    for cls in (FakeGenerativeModel, FakeImageAnnotatorClient):
+        monkeypatch.setattr(cls, 'latency', cls.latency)
+        monkeypatch.setattr(cls, 'error_rate', 0.0)
+    FakeGenerativeModel.configure(latency='fixed:10')
+    FakeImageAnnotatorClient.configure(latency='fixed:10')
+    monkeypatch.setitem(snaptrack.app.config, 'ANALYSIS_MODE', 'serial')
+    monkeypatch.setitem(snaptrack.app.config, 'VERBOSE_LOGGING', False)
+    return snaptrack.app.test_client()
+
+
+def post(client, path, **fields):
+    return client.post(path, data=dict(fields, file=(io.BytesIO(jpeg()), 'meal.jpg')))
+
+
+@pytest.mark.parametrize('use_gemini', ['true', 'false'])
+def test_done_event_has_the_upload_payload_keys(client, use_gemini):
+    expected = post(client, '/upload', use_gemini=use_gemini).get_json()
+    done = events(post(client, '/upload/stream', use_gemini=use_gemini).get_data(as_text=True))[-1]
+    assert done[0] == 'done'
+    assert set(done[1]) == set(expected)
+    assert done[1]['source'] == expected['source']
+
+
+def test_fallback_hides_provider_error_unless_verbose(client, monkeypatch):
+    monkeypatch.setattr(FakeGenerativeModel, 'error_rate', 1.0)
+    stream = events(post(client, '/upload/stream').get_data(as_text=True))
+    status = [data for event, data in stream if event == 'status']
+    assert status == [{'message': 'Gemini unavailable, falling back to Vision API'}]
+    assert stream[-1][0] == 'done'
+    assert stream[-1][1]['source'] == 'vision_api'
+    assert 'gemini_error' not in stream[-1][1]
+    assert 'cache' not in stream[-1][1]
+
+
+def test_verbose_fallback_reports_error_in_debug(client, monkeypatch):
+    monkeypatch.setattr(FakeGenerativeModel, 'error_rate', 1.0)
+    monkeypatch.setitem(snaptrack.app.config, 'VERBOSE_LOGGING', True)
+    stream = events(post(client, '/upload/stream').get_data(as_text=True))
+    status = [data for event, data in stream if event == 'status']
+    assert 'injected' in status[0]['gemini_error']
+    done = stream[-1][1]
+    assert 'injected' in done['debug']['gemini_error']
+    assert 'cache' in done['debug']
+    assert 'cache' not in done
@@ -0,0 +1,174 @@
+import io
+import struct
+
+from image_buffer import sniff_mime_type
+
+
+class UploadRejected(Exception):
+    """An upload refused before analysis. reason is a short code used as a metric label;
+    details, if given, is included in the error response."""
+
+    def __init__(self, reason, message, status=400, details=None):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+        self.details = details
+
+
+def _jpeg_size(head):
+    """(width, height) from the first SOF segment, or None if it isn't in head yet"""
+    position = 2
+    while position + 4 <= len(head):
+        if head[position] != 0xFF:
+            raise UploadRejected('corrupt', 'The image file is corrupt')
+        marker = head[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            position += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            # Standalone markers carry no length
+            position += 2
+            continue
+        length = struct.unpack('>H', head[position + 2:position + 4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if position + 9 > len(head):
+                return None
+            height, width = struct.unpack('>HH', head[position + 5:position + 9])
+            return width, height
+        if marker == 0xD9 or length < 2:
+            raise UploadRejected('corrupt', 'The image file is corrupt')
+        position += 2 + length
+    return None
+
+
+def _webp_size(head):
+    chunk = head[12:16]
+    if chunk == b'VP8 ' and len(head) >= 30:
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(head) >= 25:
+        b0, b1, b2, b3 = head[21:25]
+        return 1 + (b0 | (b1 & 0x3F) << 8), 1 + (b1 >> 6 | b2 << 2 | (b3 & 0x0F) << 10)
+    if chunk == b'VP8X' and len(head) >= 30:
+        return 1 + int.from_bytes(head[24:27], 'little'), 1 + int.from_bytes(head[27:30], 'little')
+    if len(head) >= 30:
+        raise UploadRejected('corrupt', 'The image file is corrupt')
+    return None
+
+
+def probe_image_header(head):
+    """(mime_type, (width, height)) from the start of an image file, without decoding it.
+
+    The size is None if head is too short to contain it yet. Raises
+    UploadRejected if the bytes are not a supported image.
+    """
+    if len(head) < 12:
+        return None, None
+    mime_type = sniff_mime_type(bytes(head[:12]))
+    if mime_type is None:
+        raise UploadRejected('unsupported_type', 'The file is not a PNG, JPEG, GIF or WebP image', 415)
+
+    size = None
+    if mime_type == 'image/png' and len(head) >= 24:
+        size = struct.unpack('>II', head[16:24])
+    elif mime_type == 'image/gif' and len(head) >= 10:
+        size = struct.unpack('<HH', head[6:10])
+    elif mime_type == 'image/webp':
+        size = _webp_size(head)
+    elif mime_type == 'image/jpeg':
+        size = _jpeg_size(head)
+    return mime_type, size
+
+
+def check_dimensions(size, limits):
+    """Enforce the pixel-count and dimension limits on a declared image size"""
+    width, height = size
+    if min(width, height) < limits['min_dimension']:
+        raise UploadRejected('too_small', f"The image is too small ({width}x{height})")
+    if max(width, height) > limits['max_dimension']:
+        raise UploadRejected('dimensions_too_large',
+                             f"The image is too large ({width}x{height}); the longest side may be "
+                             f"at most {limits['max_dimension']} pixels", 413)
+    if width * height > limits['max_pixels']:
+        raise UploadRejected('too_many_pixels',
+                             f"The image has too many pixels ({width}x{height}); the limit is "
+                             f"{limits['max_pixels']:,}", 413)
+
+
+def check_filename(filename, allowed_extensions):
+    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if extension not in allowed_extensions:
+        raise UploadRejected('extension', 'Invalid file type. Please upload an image (PNG, JPG, JPEG, GIF, WEBP)')
+
+
+class GuardedStream(io.BytesIO):
+    """In-memory buffer for a multipart file part that screens the image as the
+    parser writes it, so a bad upload fails before the rest of the body is read.
+
+    The extension is checked before any data arrives; the magic bytes and the
+    declared dimensions as soon as the first chunk holds them. If the size isn't
+    within the first probe_bytes, screening is left to check_image().
+
+    With abort=False a rejection is recorded in .rejection instead of raised,
+    and the rest of that file is discarded as it arrives (for batch uploads,
+    where one bad file shouldn't fail the others).
+    """
+
+    def __init__(self, filename, limits, abort=True):
+        super().__init__()
+        self.limits = limits
+        self.abort = abort
+        self.screened = False
+        self.rejection = None
+        if filename:
+            self._screen(check_filename, filename, limits['allowed_extensions'])
+
+    def _screen(self, check, *args):
+        try:
+            check(*args)
+        except UploadRejected as e:
+            if self.abort:
+                raise
+            self.rejection = e
+            self.screened = True
+            self.seek(0)
+            self.truncate()
+
+    def _check_head(self):
+        head = self.getvalue()[:self.limits['probe_bytes']]
+        mime_type, size = probe_image_header(head)
+        if size is not None:
+            check_dimensions(size, self.limits)
+            self.screened = True
+        elif len(head) >= self.limits['probe_bytes']:
+            self.screened = True
+
+    def write(self, data):
+        if self.rejection is not None:
+            return len(data)
+        written = super().write(data)
+        if not self.screened:
+            self._screen(self._check_head)
+        return written
+
+
+def check_image(data, limits):
+    """Full screening of a completely received upload: supported type, a header PIL
+    can read, and the dimension limits. Only the header is parsed, not the pixels."""
+    mime_type, size = probe_image_header(data[:limits['probe_bytes']])
+    if mime_type is None:
+        raise UploadRejected('unsupported_type', 'The file is not a PNG, JPEG, GIF or WebP image', 415)
+    if size is not None:
+        check_dimensions(size, limits)
+
+    import PIL.Image
+    # Decoding anything bigger than this raises DecompressionBombError instead of allocating it
+    PIL.Image.MAX_IMAGE_PIXELS = limits['max_pixels']
+    try:
+        image = PIL.Image.open(io.BytesIO(data))
+    except PIL.Image.DecompressionBombError:
+        raise UploadRejected('too_many_pixels', 'The image has too many pixels', 413)
+    except Exception:
+        raise UploadRejected('corrupt', 'The image file is corrupt')
+    check_dimensions(image.size, limits)